@@ -0,0 +1,117 @@
+import gzip
+import threading
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# JSON and text compress several times over; images are compressed already
+COMPRESSIBLE_MIMETYPES = ['application/json', 'text/plain', 'text/html', 'image/svg+xml']
+
+
+def available_encodings():
+    return (['br'] if brotli is not None else []) + ['gzip']
+
+
+def negotiate_encoding(accept_encodings):
+    """The content coding to answer with given a request's Accept-Encoding: brotli when it is installed and
+    accepted, else gzip when accepted, else None."""
+    return accept_encodings.best_match(available_encodings())
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+class ResponseCompression:
+    """Compresses JSON and text responses of at least COMPRESSION_MIN_BYTES with the best coding the client
+    accepts (see negotiate_encoding).  Streamed responses and ones that already have a Content-Encoding are
+    sent as they are.  A compressed response's ETag is made weak, so routes compare If-None-Match weakly.
+
+    Documents that never change again, like a finished game's results, can be kept ready-encoded with
+    precompressed(), which holds the last COMPRESSION_CACHE_ENTRIES of them per worker.  A game's documents
+    are dropped whenever GameEvents reports a change to it, e.g. its deletion.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._documents = OrderedDict()
+        self.enabled = True
+        self.min_bytes = 1024
+        self.max_entries = 256
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, events=None):
+        app.config.setdefault('COMPRESSION_ENABLED', True)
+        app.config.setdefault('COMPRESSION_MIN_BYTES', 1024)
+        app.config.setdefault('COMPRESSION_CACHE_ENTRIES', 256)
+        self.enabled = app.config['COMPRESSION_ENABLED']
+        self.min_bytes = app.config['COMPRESSION_MIN_BYTES']
+        self.max_entries = app.config['COMPRESSION_CACHE_ENTRIES']
+        app.after_request(self._compress_response)
+        if events is not None:
+            events.add_listener(self.forget)
+
+    def negotiate(self):
+        return negotiate_encoding(request.accept_encodings) if self.enabled else None
+
+    def precompressed(self, game_code, key, encoding, render):
+        """The bytes of one of a game's immutable documents, identified by key, under encoding (None for
+        none).  render() builds the document the first time it is asked for; each encoding is made once."""
+        document = self._cached((game_code, key, None), render)
+        if encoding is None:
+            return document
+        return self._cached((game_code, key, encoding), lambda: compress(document, encoding))
+
+    def forget(self, game_code):
+        with self._lock:
+            for cache_key in [cache_key for cache_key in self._documents if cache_key[0] == game_code]:
+                del self._documents[cache_key]
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+
+    def _cached(self, cache_key, make):
+        with self._lock:
+            if cache_key in self._documents:
+                self._documents.move_to_end(cache_key)
+                return self._documents[cache_key]
+        data = make()
+        with self._lock:
+            self._documents[cache_key] = data
+            while len(self._documents) > self.max_entries:
+                self._documents.popitem(last=False)
+        return data
+
+    def _compress_response(self, response):
+        if not self.enabled or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.status_code < 200 or response.status_code in (204, 304) or response.direct_passthrough \
+                or response.is_streamed or 'Content-Encoding' in response.headers \
+                or (response.content_length or 0) < self.min_bytes:
+            return response
+        encoding = self.negotiate()
+        if encoding is None:
+            return response
+        response.set_data(compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+        mark_encoded(response)
+        return response
+
+
+def mark_encoded(response):
+    # the bytes differ from the identity body, but it is the same document
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
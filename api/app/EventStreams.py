@@ -0,0 +1,188 @@
+import asyncio
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, parse_qsl, urlencode
+
+from app import events, game_cache, has_news_for, load_game_state, parse_long_poll, render_game_events, \
+    render_state_events
+
+EVENTS_PATH = re.compile(r'^/game/(?P<gamecode>.+)/events$')
+STATUS_PATH = re.compile(r'^/game/(?P<gamecode>.+?)/player/(?P<username>.+)$')
+STREAM_HEADERS = [(b'content-type', b'text/event-stream; charset=utf-8'),
+                  (b'cache-control', b'no-cache'),
+                  (b'x-accel-buffering', b'no'),
+                  (b'access-control-allow-origin', b'*')]
+
+
+class AsyncSubscription:
+    """A GameEvents subscriber that wakes a coroutine.  Changes are published from worker threads, so they
+    are handed to the event loop rather than put on the asyncio queue directly."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=1)
+
+    def put_nowait(self, game_code):
+        self.loop.call_soon_threadsafe(self._put, game_code)
+
+    def _put(self, game_code):
+        if not self.queue.full():
+            self.queue.put_nowait(game_code)
+
+
+class EventStreamApp:
+    """ASGI entry point that keeps open event streams on the event loop instead of holding a thread each.
+
+    GET /game/<code>/events is answered here: an idle stream is a coroutine and a one-slot queue, and the
+    thread pool is only borrowed when a change has to be read from the database rather than the GameCache.
+    Long polls of a player's status (?wait=) are held here the same way and then answered by Flask.  Every
+    other request goes to the Flask app through a2wsgi.  Both use ASGI_THREADS threads.  Serve it with any
+    ASGI server, e.g. `uvicorn asgi:app`.
+    """
+
+    def __init__(self, flask_app):
+        try:
+            from a2wsgi import WSGIMiddleware
+        except ImportError:
+            raise RuntimeError('Serving over ASGI needs the a2wsgi package.')
+        flask_app.config.setdefault('ASGI_THREADS', 16)
+        self.flask_app = flask_app
+        self.keepalive_seconds = flask_app.config['GAME_EVENTS_KEEPALIVE_SECONDS']
+        self.long_poll_max_seconds = flask_app.config['GAME_LONG_POLL_MAX_SECONDS']
+        self.executor = ThreadPoolExecutor(max_workers=flask_app.config['ASGI_THREADS'],
+                                           thread_name_prefix='event-render')
+        self.wsgi = WSGIMiddleware(flask_app, workers=flask_app.config['ASGI_THREADS'])
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            match = EVENTS_PATH.match(scope['path'])
+            if match is not None:
+                return await self.stream(scope, receive, send, match.group('gamecode'))
+            match = STATUS_PATH.match(scope['path'])
+            if match is not None:
+                scope = await self.hold_long_poll(scope, match.group('gamecode'), match.group('username'))
+        return await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def stream(self, scope, receive, send, gamecode):
+        loop = asyncio.get_event_loop()
+        username = parse_qs(scope['query_string'].decode('latin-1')).get('username', [''])[0]
+        base_url = base_url_for(scope)
+        subscription = AsyncSubscription(loop)
+        # subscribe before the first render, so a change made in between still wakes the stream
+        events.subscribe(gamecode, subscription)
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        try:
+            message, last_sent = await loop.run_in_executor(
+                self.executor, self.render, base_url, gamecode, username, {})
+            if message is None:
+                return await send_error(send, 'No such game: "' + gamecode + '".')
+            await send({'type': 'http.response.start', 'status': 200, 'headers': STREAM_HEADERS})
+            while True:
+                if message:
+                    await send({'type': 'http.response.body', 'body': message.encode('utf-8'), 'more_body': True})
+                changed = asyncio.ensure_future(subscription.queue.get())
+                done, _ = await asyncio.wait([changed, disconnected], timeout=self.keepalive_seconds,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if disconnected in done:
+                    changed.cancel()
+                    return
+                if changed in done:
+                    # the first stream to wake refills the cache; the rest render from it on the loop
+                    state = game_cache.peek(gamecode)
+                    if state is not None:
+                        message, last_sent = self.render_cached(base_url, state, username, last_sent)
+                    else:
+                        message, last_sent = await loop.run_in_executor(
+                            self.executor, self.render, base_url, gamecode, username, last_sent)
+                    if message is None:
+                        # the game was deleted
+                        return await send({'type': 'http.response.body', 'body': b''})
+                else:
+                    changed.cancel()
+                    message = ': keepalive\n\n'
+        finally:
+            disconnected.cancel()
+            events.unsubscribe(gamecode, subscription)
+
+    async def hold_long_poll(self, scope, gamecode, username):
+        """Waits on the loop until a ?wait= status request has something new to say, and returns the request
+        for Flask to answer without waiting again.  Malformed parameters are left for Flask to reject."""
+        parameters = parse_qsl(scope['query_string'].decode('latin-1'))
+        try:
+            since, wait = parse_long_poll(dict(parameters), self.long_poll_max_seconds)
+        except ValueError:
+            return scope
+        if not wait:
+            return scope
+        loop = asyncio.get_event_loop()
+        base_url = base_url_for(scope)
+        subscription = AsyncSubscription(loop)
+        events.subscribe(gamecode, subscription)
+        try:
+            state = await self.load(loop, base_url, gamecode)
+            if not has_news_for(state, username, since):
+                seen = state['statuses'][username]
+                deadline = loop.time() + wait
+                while state is not None and state['statuses'].get(username) == seen:
+                    try:
+                        await asyncio.wait_for(subscription.queue.get(), max(deadline - loop.time(), 0))
+                    except asyncio.TimeoutError:
+                        break
+                    state = await self.load(loop, base_url, gamecode)
+        finally:
+            events.unsubscribe(gamecode, subscription)
+        query_string = urlencode([(name, value) for name, value in parameters if name != 'wait'])
+        return dict(scope, query_string=query_string.encode('latin-1'))
+
+    async def load(self, loop, base_url, gamecode):
+        state = game_cache.peek(gamecode)
+        if state is None:
+            state = await loop.run_in_executor(self.executor, self.load_state, base_url, gamecode)
+        return state
+
+    def load_state(self, base_url, gamecode):
+        with self.flask_app.test_request_context(base_url=base_url):
+            return game_cache.get(gamecode, load_game_state)
+
+    def render(self, base_url, gamecode, username, last_sent):
+        # prompts are image URLs, which are built against the host the client connected to
+        with self.flask_app.test_request_context(base_url=base_url):
+            return render_game_events(gamecode, username, last_sent)
+
+    def render_cached(self, base_url, state, username, last_sent):
+        with self.flask_app.test_request_context(base_url=base_url):
+            return render_state_events(state, username, last_sent)
+
+
+def base_url_for(scope):
+    headers = dict(scope['headers'])
+    if b'host' in headers:
+        host = headers[b'host'].decode('latin-1')
+    else:
+        host = '{}:{}'.format(*scope['server'])
+    return scope.get('scheme', 'http') + '://' + host + scope.get('root_path', '')
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def send_error(send, message, status_code=400):
+    body = json.dumps({'error': message}).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status_code,
+                'headers': [(b'content-type', b'application/json'), (b'access-control-allow-origin', b'*')]})
+    await send({'type': 'http.response.body', 'body': body})
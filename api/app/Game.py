@@ -1,33 +1,77 @@
 from flask_sqlalchemy import SQLAlchemy
 
-from app import db
+from app import db, events, game_cache, replicas
+from app.GameIndex import GameIndex
 from app.ImageSubmission import ImageSubmission
 from app.PhraseSubmission import PhraseSubmission
 from app.Player import Player
 
 MAX_CODE_LENGTH = 40
+MAX_STATE_LENGTH = 32
+
+
+def summarize(state, phase, players):
+    """A game's summary from its stored round state and its players' (username, status) pairs in seat order."""
+    return {'canJoin': state == 'WAITING_FOR_PLAYERS',
+            'canStart': len(players) >= 2 and phase < 2,
+            'phaseNumber': phase,
+            'isOver': state == 'GAME_OVER',
+            'players': [{'username': username, 'status': {'description': status}} for username, status in players]}
+
 
 class Game(db.Model):
+    # a game's rows live on the shard its code hashes to (see GameShards)
+    __table_args__ = {'info': {'sharded': True}}
+
     id = db.Column(db.Integer, primary_key=True)
     code = db.Column(db.String(MAX_CODE_LENGTH), unique=True, nullable=False)
+    # bumped on every committed change, so clients can ask "has anything happened since version N?"  Also the
+    # row's optimistic lock: the UPDATE only matches the version the change was made from, and raises
+    # StaleDataError if another worker committed first (see change_game).
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Round bookkeeping is kept on the game row and updated with every submission, so reads never have to
+    # count submissions or scan player statuses.  compute_derived_state() rebuilds it from the submissions.
+    state = db.Column(db.String(MAX_STATE_LENGTH), nullable=False, index=True, default='WAITING_FOR_PLAYERS',
+                      server_default='WAITING_FOR_PLAYERS')
+    phase = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    phrase_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    image_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    round_submission_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # Submissions are queried on demand rather than eagerly joined: the status and summary polls only need
+    # row counts, and loading every image with every poll is what made those endpoints expensive.
+    image_submissions = db.relationship(ImageSubmission, lazy='dynamic', order_by=ImageSubmission.id)
+    phrase_submissions = db.relationship(PhraseSubmission, lazy='dynamic', order_by=PhraseSubmission.id)
 
-    image_submissions = db.relationship(ImageSubmission, lazy='joined')
-    phrase_submissions = db.relationship(PhraseSubmission, lazy='joined')
+    players = db.relationship(Player, lazy='joined', order_by=(Player.seat, Player.id))
 
-    players = db.relationship(Player, lazy='joined')
+    __mapper_args__ = {'version_id_col': version, 'version_id_generator': False}
 
     def __init__(self, game_code):
         self.code = game_code
+        self.version = 0
+        self.state = 'WAITING_FOR_PLAYERS'
+        self.phase = 1
+        self.phrase_count = 0
+        self.image_count = 0
+        self.round_submission_count = 0
+        # known to be empty, so a new game's first join need not load them
+        self.players = []
+
+    @property
+    def index(self):
+        if getattr(self, '_index', None) is None:
+            self._index = GameIndex(self)
+        return self._index
+
+    def invalidate_index(self):
+        self._index = None
 
     def get_player(self, username):
-        return next((player for player in self.players if player.get_name() == username), None)
+        return self.index.get_player(username)
 
     def is_over(self):
-        number_of_users = len(self.players)
-        if number_of_users < 1:
-            return False
-        else:
-            return len(self.phrase_submissions) + len(self.image_submissions) == number_of_users ** 2
+        return self.state == 'GAME_OVER'
 
     def is_action_allowed(self, username, action):
         if action == "submitphrase":
@@ -37,10 +81,10 @@ class Game(db.Model):
         return False
 
     def has_player(self, username):
-        return username in self.get_playernames()
+        return username in self.index.players_by_name
 
     def too_late_to_join(self):
-        return not all(status == "SUBMIT_INITIAL_PHRASE" for status in list(p.get_status() for p in self.players))
+        return self.state != 'WAITING_FOR_PLAYERS'
 
     def too_early_to_start(self):
         return len(self.players) < 2
@@ -50,65 +94,131 @@ class Game(db.Model):
         self.update_status_if_all_players_done()
 
     def update_status_if_all_players_done(self):
-        if all(status == 'WAIT' for status in (p.get_status() for p in self.players))   :
+        if self.round_submission_count >= len(self.players):
+            self.phase += 1
+            self.round_submission_count = 0
+            if self.phrase_count + self.image_count >= len(self.players) ** 2:
+                self.state = 'GAME_OVER'
             next_status = 'SUBMIT_PHRASE' if self.get_phase_number() % 2 == 1 else 'SUBMIT_IMAGE'
             if self.is_over():
                 next_status = 'GAME_OVER'
-            for user in self.get_playernames():
-                self.set_user_status(user, next_status)
+            self.set_all_user_statuses(next_status)
+
+    def set_all_user_statuses(self, new_status):
+        # one UPDATE for the whole room; 'evaluate' also refreshes the loaded players without re-flushing them
+        Player.query.filter_by(game_id=self.id).update({Player.status: new_status}, synchronize_session='evaluate')
 
     def get_phase_number(self):
-        current_number_of_players = len(self.players)
-        if len(self.phrase_submissions) < current_number_of_players:
-            return 1
-        elif len(self.image_submissions) < current_number_of_players:
-            return 2
+        return self.phase
+
+    def compute_derived_state(self):
+        """Recomputes the round bookkeeping columns by counting submissions, the way they were derived
+        before they were stored.  Used to backfill existing games and to check the stored values."""
+        number_of_players = len(self.players)
+        phrase_count = self.phrase_submissions.count()
+        image_count = self.image_submissions.count()
+        submission_count = phrase_count + image_count
+        completed_rounds = submission_count // number_of_players if number_of_players else 0
+        if number_of_players and submission_count >= number_of_players ** 2:
+            state = 'GAME_OVER'
+        elif phrase_count > 0:
+            state = 'IN_PROGRESS'
         else:
-            completed_phrase_rounds = len(self.phrase_submissions) / len(self.players)
-            completed_image_rounds = len(self.image_submissions) / len(self.players)
-            return 1 + completed_image_rounds + completed_phrase_rounds
+            state = 'WAITING_FOR_PLAYERS'
+        return {'state': state,
+                'phase': 1 + completed_rounds,
+                'phrase_count': phrase_count,
+                'image_count': image_count,
+                'round_submission_count': submission_count - completed_rounds * number_of_players}
+
+    def get_stored_state(self):
+        return {'state': self.state,
+                'phase': self.phase,
+                'phrase_count': self.phrase_count,
+                'image_count': self.image_count,
+                'round_submission_count': self.round_submission_count}
 
-    def save_phrase(self, username, new_phrase):
-        self.phrase_submissions.append(PhraseSubmission(self.get_player(username), new_phrase))
+    def count_submission(self, type):
+        if type == 'phrase':
+            self.phrase_count += 1
+        else:
+            self.image_count += 1
+        self.round_submission_count += 1
+        if self.state == 'WAITING_FOR_PLAYERS':
+            self.state = 'IN_PROGRESS'
+
+    def save_phrase(self, username, new_phrase, idempotency_key=None):
+        self.phrase_submissions.append(PhraseSubmission(self.get_player(username), new_phrase, idempotency_key))
+        self.count_submission('phrase')
+        self.invalidate_index()
         self.set_user_status(username, "WAIT")
-        db.session.commit()
+        return self.commit_changes()
 
 
-    def save_image(self, username, new_image):
-        self.image_submissions.append(ImageSubmission(self.get_player(username), new_image))
+    def save_image(self, username, new_image_id, idempotency_key=None):
+        self.image_submissions.append(ImageSubmission(self.get_player(username), new_image_id, idempotency_key))
+        self.count_submission('image')
+        self.invalidate_index()
         self.set_user_status(username, "WAIT")
-        db.session.commit()
+        return self.commit_changes()
+
+    def has_submission_with_key(self, username, type, idempotency_key):
+        submissions = self.image_submissions if type == 'image' else self.phrase_submissions
+        return submissions.filter_by(player_id=self.get_player(username).id, idempotency_key=idempotency_key) \
+            .order_by(None).first() is not None
 
 
     def join(self, username):
         if not self.has_player(username):
-            self.players.append(Player(username))
+            self.players.append(Player(username, seat=len(self.players)))
+            self.invalidate_index()
             self.set_user_status(username, 'SUBMIT_INITIAL_PHRASE')
-            db.session.commit()
+            return self.commit_changes()
+        return self.version
+
+    def commit_changes(self):
+        """Commits and returns the game's new version."""
+        self.version += 1
+        # read before committing, which expires the row and would reload it just for them
+        code, version = self.code, self.version
+        db.session.commit()
+        game_cache.invalidate(code)
+        # before the change is published, so no read in between goes to a replica without it
+        replicas.changed(code)
+        events.publish(code)
+        return version
+
+    def get_summary(self):
+        return summarize(self.state, self.get_phase_number(),
+                         [(player.name, player.get_status()) for player in self.players])
 
     def get_phrase_prompt(self, username):
         username_of_phrase_source = self.get_previous_player(username)
-        return self.get_all_submissions_by_player(self.get_player(username_of_phrase_source), type='phrase')[-1].get_phrase()
+        return self.get_latest_submission_by_player(self.get_player(username_of_phrase_source), type='phrase').get_phrase()
 
     def get_image_prompt(self, username):
+        """The id of the image username is to describe.  Its URL depends on the host the client connected to, so
+        it is left to each response (see status_for_client) rather than kept in cached state."""
         username_of_image_source = self.get_previous_player(username)
-        return self.get_all_submissions_by_player(self.get_player(username_of_image_source))[-1].get_image()
+        return self.get_latest_submission_by_player(self.get_player(username_of_image_source)).get_image()
 
     def get_all_submissions_by_player(self, player, type='image'):
-        return list(filter(lambda x: x.get_player() == player, self.image_submissions if type == 'image' else self.phrase_submissions))
+        return self.index.get_submissions(player, type)
+
+    def get_latest_submission_by_player(self, player, type='image'):
+        # a prompt needs one row, so skip building the full submission index on status polls
+        submission_class = ImageSubmission if type == 'image' else PhraseSubmission
+        submissions = self.image_submissions if type == 'image' else self.phrase_submissions
+        return submissions.filter_by(player_id=player.id).order_by(None).order_by(submission_class.id.desc()).first()
 
     def get_playernames(self):
-        return [player.name for player in self.players]
+        return self.index.usernames
 
     def get_next_player(self, username):
-        usernames = self.get_playernames()
-        return usernames[0] if usernames.index(username) == len(usernames) - 1 else usernames[
-            usernames.index(username) + 1]
+        return self.index.get_username_at_seat(self.index.get_seat(username) + 1)
 
     def get_previous_player(self, username):
-        usernames = self.get_playernames()
-        return usernames[len(usernames) - 1] if usernames.index(username) == 0 else usernames[
-            usernames.index(username) - 1]
+        return self.index.get_username_at_seat(self.index.get_seat(username) - 1)
 
     def get_user_status(self, username, just_the_status=False):
         status_for_user = self.get_player(username).get_status()
@@ -124,21 +234,43 @@ class Game(db.Model):
                 'nextPlayerUsername': self.get_next_player(username)}
 
     def get_all_submission_threads_indexed_by_user(self):
-        return [
-            {
-                "originator": p.name,
-                "submissions": self.get_user_submission_thread(p.name)
-            } for p in self.players
-        ]
+        return list(self.get_submission_threads(self.get_playernames()))
+
+    def get_submission_threads(self, originators):
+        for username in originators:
+            yield {
+                "originator": username,
+                "submissions": self.get_user_submission_thread(username)
+            }
 
     def get_user_submission_thread(self, username):
-        users = self.get_playernames()
-        index_of_original_user = users.index(username)
-        to_return = [self.get_all_submissions_by_player(self.get_player(username), type='phrase')[0].get_phrase()]
-        for i in range(1, len(users)):
-            user = users[(index_of_original_user + i) % len(users)]
-            to_return.append(
-                self.get_all_submissions_by_player(self.get_player(user), type='phrase')[int(i / 2)].get_phrase() if i % 2 == 0 else
-                self.get_all_submissions_by_player(self.get_player(user))[
-                    int(i / 2)].get_image())
-        return to_return
+        return [submission.get_phrase() if type == 'phrase' else submission.get_image_url()
+                for type, submission in self.get_thread_submissions(username)]
+
+    def get_thread_submissions(self, username):
+        """The (type, submission) pairs of the thread username started, one per seat from theirs onwards."""
+        index_of_original_user = self.index.get_seat(username)
+        thread = []
+        for i in range(len(self.get_playernames())):
+            player = self.get_player(self.index.get_username_at_seat(index_of_original_user + i))
+            type = 'phrase' if i % 2 == 0 else 'image'
+            thread.append((type, self.get_all_submissions_by_player(player, type=type)[i // 2]))
+        return thread
+
+    def get_compact_results(self, originators):
+        """The threads of originators as one table of submissions, each listed once as [id, author, type, ref],
+        and for each thread the ids of its submissions in order.  An author is a seat in the players list, a
+        phrase's ref is its text and an image's is its image id, which is served at /image/<ref>."""
+        authors = {player.id: seat for seat, player in enumerate(self.players)}
+        ids, submissions, threads = {}, [], []
+        for username in originators:
+            thread = []
+            for type, submission in self.get_thread_submissions(username):
+                key = (type, submission.id)
+                if key not in ids:
+                    ids[key] = len(submissions)
+                    ref = submission.get_phrase() if type == 'phrase' else submission.get_image()
+                    submissions.append([ids[key], authors[submission.player_id], type, ref])
+                thread.append(ids[key])
+            threads.append({'originator': username, 'submissions': thread})
+        return {'players': self.get_playernames(), 'submissions': submissions, 'threads': threads}
@@ -0,0 +1,144 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+KEY_PREFIX = 'teledraw:state:'
+# counts each game's shared invalidations, so a state loaded before one is never shared after it
+GENERATION_PREFIX = 'teledraw:generation:'
+
+
+class GameCache:
+    """Compact, ready-to-serve state of recently polled games, keyed by game code.
+
+    Entries live in a per-process LRU (GAME_CACHE_MAX_ENTRIES) for at most GAME_CACHE_TTL_SECONDS and are
+    dropped whenever the game changes: Game.commit_changes() invalidates them directly, and the GameEvents
+    listener does the same for changes made by other workers when GAME_EVENTS_REDIS_URL is set.  With
+    GAME_CACHE_REDIS_URL the entries are also shared between workers through any Redis-protocol server.
+    Entries hold nothing that depends on the host a client connected to, like image URLs, so any request may
+    be answered from any entry.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._invalidations = 0
+        self._redis = None
+        self._watch_error = None
+        self.ttl_seconds = 30
+        self.max_entries = 1024
+        self.counters = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, events=None):
+        app.config.setdefault('GAME_CACHE_TTL_SECONDS', 30)
+        app.config.setdefault('GAME_CACHE_MAX_ENTRIES', 1024)
+        app.config.setdefault('GAME_CACHE_REDIS_URL', None)
+        self.ttl_seconds = app.config['GAME_CACHE_TTL_SECONDS']
+        self.max_entries = app.config['GAME_CACHE_MAX_ENTRIES']
+        redis_url = app.config['GAME_CACHE_REDIS_URL']
+        if redis_url and self._redis is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError('GAME_CACHE_REDIS_URL is set but the redis package is not installed.')
+            self._redis = redis.Redis.from_url(redis_url)
+            self._watch_error = redis.WatchError
+        if events is not None:
+            events.add_listener(self.invalidate_local)
+
+    def get(self, game_code, load):
+        """Returns the cached state for game_code, calling load(game_code) to fill it on a miss.
+        States that load returns as None (no such game) are not cached."""
+        with self._lock:
+            entry = self._entries.get(game_code)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(game_code)
+                self.counters['hits'] += 1
+                return entry[1]
+            invalidations_before_load = self._invalidations
+        generation_before_load = self._get_shared_generation(game_code)
+        state = self._get_shared(game_code)
+        with self._lock:
+            self.counters['hits' if state is not None else 'misses'] += 1
+        if state is None:
+            state = load(game_code)
+            if state is not None:
+                self._set_shared(game_code, state, generation_before_load)
+        if state is not None:
+            with self._lock:
+                # a change committed while we were loading may not be in what we loaded
+                if self._invalidations == invalidations_before_load:
+                    self._entries[game_code] = (time.monotonic() + self.ttl_seconds, state)
+                    self._entries.move_to_end(game_code)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self.counters['evictions'] += 1
+        return state
+
+    def peek(self, game_code):
+        """Returns the state cached in this process for game_code, or None, without ever loading it."""
+        with self._lock:
+            entry = self._entries.get(game_code)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            self._entries.move_to_end(game_code)
+            self.counters['hits'] += 1
+            return entry[1]
+
+    def invalidate(self, game_code):
+        self.invalidate_local(game_code)
+        if self._redis is not None:
+            with self._redis.pipeline() as pipe:
+                pipe.incr(GENERATION_PREFIX + game_code)
+                pipe.expire(GENERATION_PREFIX + game_code, self.ttl_seconds)
+                pipe.delete(KEY_PREFIX + game_code)
+                pipe.execute()
+
+    def invalidate_local(self, game_code):
+        with self._lock:
+            self._invalidations += 1
+            self.counters['invalidations'] += 1
+            self._entries.pop(game_code, None)
+
+    def clear(self):
+        with self._lock:
+            self._invalidations += 1
+            self._entries.clear()
+        if self._redis is not None:
+            for key in self._redis.scan_iter(KEY_PREFIX + '*'):
+                self._redis.delete(key)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, size=len(self._entries), maxEntries=self.max_entries,
+                        ttlSeconds=self.ttl_seconds, shared=self._redis is not None)
+
+    def _get_shared(self, game_code):
+        if self._redis is None:
+            return None
+        cached = self._redis.get(KEY_PREFIX + game_code)
+        return None if cached is None else json.loads(cached)
+
+    def _get_shared_generation(self, game_code):
+        if self._redis is None:
+            return None
+        return self._redis.get(GENERATION_PREFIX + game_code)
+
+    def _set_shared(self, game_code, state, generation_before_load):
+        """Shares a loaded state unless the game was invalidated, by any worker, since its load began: another
+        worker's commit in between may not be in it, and would otherwise be hidden by it until it expires."""
+        if self._redis is None:
+            return
+        with self._redis.pipeline() as pipe:
+            try:
+                pipe.watch(GENERATION_PREFIX + game_code)
+                if pipe.get(GENERATION_PREFIX + game_code) != generation_before_load:
+                    return
+                pipe.multi()
+                pipe.set(KEY_PREFIX + game_code, json.dumps(state), ex=self.ttl_seconds)
+                pipe.execute()
+            except self._watch_error:
+                # invalidated between the check and the write
+                pass
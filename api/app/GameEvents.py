@@ -0,0 +1,80 @@
+import queue
+import threading
+from collections import defaultdict
+
+CHANNEL_PREFIX = 'teledraw:game:'
+
+
+class GameEvents:
+    """Publish/subscribe of "this game changed" notifications, keyed by game code.
+
+    Subscribers get a queue that receives the game code whenever the game is committed with new state.
+    Notifications carry no payload: subscribers re-read the game, so a burst of changes collapses into one.
+    By default delivery is in-process; set GAME_EVENTS_REDIS_URL to fan out through any Redis-protocol
+    server so that every worker process hears about changes made by the others.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._listeners = []
+        self._redis = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('GAME_EVENTS_REDIS_URL', None)
+        app.config.setdefault('GAME_EVENTS_KEEPALIVE_SECONDS', 15)
+        redis_url = app.config['GAME_EVENTS_REDIS_URL']
+        if redis_url and self._redis is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError('GAME_EVENTS_REDIS_URL is set but the redis package is not installed.')
+            self._redis = redis.Redis.from_url(redis_url)
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(**{CHANNEL_PREFIX + '*': self._relay})
+            pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def subscribe(self, game_code, subscription=None):
+        """Registers a queue for game_code's changes.  Any object with a put_nowait that drops what it cannot
+        hold will do in place of the default one-slot queue."""
+        if subscription is None:
+            subscription = queue.Queue(maxsize=1)
+        with self._lock:
+            self._subscribers[game_code].add(subscription)
+        return subscription
+
+    def unsubscribe(self, game_code, subscription):
+        with self._lock:
+            self._subscribers[game_code].discard(subscription)
+            if not self._subscribers[game_code]:
+                del self._subscribers[game_code]
+
+    def add_listener(self, callback):
+        """Calls callback(game_code) for every change heard, before any subscriber is woken."""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def publish(self, game_code):
+        if self._redis is not None:
+            self._redis.publish(CHANNEL_PREFIX + game_code, '')
+        else:
+            self._deliver(game_code)
+
+    def _relay(self, message):
+        channel = message['channel']
+        if isinstance(channel, bytes):
+            channel = channel.decode('utf-8')
+        self._deliver(channel[len(CHANNEL_PREFIX):])
+
+    def _deliver(self, game_code):
+        for callback in self._listeners:
+            callback(game_code)
+        with self._lock:
+            subscriptions = list(self._subscribers.get(game_code, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.put_nowait(game_code)
+            except queue.Full:
+                pass
@@ -0,0 +1,38 @@
+from collections import defaultdict
+
+from sqlalchemy.orm import lazyload
+
+
+class GameIndex:
+    """Lookup tables over one loaded game: player by name, seat by name and each player's submissions in order.
+
+    Players are indexed when the view is built.  Submissions are read with one query per type the first
+    time they are asked for, then grouped by player, so building every results thread is linear in the
+    number of submissions.  The view is a snapshot: Game drops it whenever it adds players or submissions.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.usernames = [player.name for player in game.players]
+        self.players_by_name = {player.name: player for player in game.players}
+        self.seats_by_name = {username: seat for seat, username in enumerate(self.usernames)}
+        self._submissions_by_player_id = {}
+
+    def get_player(self, username):
+        return self.players_by_name.get(username)
+
+    def get_seat(self, username):
+        return self.seats_by_name[username]
+
+    def get_username_at_seat(self, seat):
+        return self.usernames[seat % len(self.usernames)]
+
+    def get_submissions(self, player, type='image'):
+        if type not in self._submissions_by_player_id:
+            grouped = defaultdict(list)
+            submissions = self.game.image_submissions if type == 'image' else self.game.phrase_submissions
+            # the players are already indexed, so skip the eager player join on every submission row
+            for submission in submissions.options(lazyload('player')):
+                grouped[submission.player_id].append(submission)
+            self._submissions_by_player_id[type] = grouped
+        return self._submissions_by_player_id[type].get(player.id, [])
@@ -0,0 +1,111 @@
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, exists, or_
+
+from app import db, events, game_cache, image_store, shards
+from app.Game import Game
+from app.ImageSubmission import ImageSubmission
+from app.PhraseSubmission import PhraseSubmission
+from app.Player import Player
+
+
+def delete_games(game_ids):
+    """Deletes games of the session's shard with their players and submissions, and the stored images only
+    they referred to.
+
+    Commits once; callers keep game_ids to a batch so that no transaction holds its locks for long.
+    """
+    if not game_ids:
+        return 0
+    codes = [code for (code,) in db.session.query(Game.code).filter(Game.id.in_(game_ids))]
+    image_ids = {image_id for (image_id,) in
+                 db.session.query(ImageSubmission.image_id).filter(ImageSubmission.game_id.in_(game_ids)).distinct()}
+    for model in [PhraseSubmission, ImageSubmission, Player]:
+        model.query.filter(model.game_id.in_(game_ids)).delete(synchronize_session=False)
+    Game.query.filter(Game.id.in_(game_ids)).delete(synchronize_session=False)
+    # images are shared by content, so keep any that another game's submission, on any shard, still points at
+    still_used = set()
+    if image_ids:
+        for shard in shards.each():
+            still_used.update(image_id for (image_id,) in db.session.query(ImageSubmission.image_id)
+                              .filter(ImageSubmission.image_id.in_(image_ids)))
+    image_store.delete(image_ids - still_used)
+    db.session.commit()
+    # the bulk deletes bypass the session, which would otherwise keep the deleted rows' objects under ids
+    # the database may hand out again
+    db.session.expunge_all()
+    for code in codes:
+        game_cache.invalidate(code)
+        events.publish(code)
+    return len(codes)
+
+
+class GameJanitor:
+    """Purges finished and abandoned games so storage stays bounded.
+
+    A game's last activity is its latest player join or submission.  Finished games go GAME_RETENTION_HOURS
+    after that, unfinished ones GAME_ABANDONED_HOURS after it.  Games are deleted JANITOR_BATCH_SIZE at a
+    time, one short transaction each.  Workers never purge on their own: one `flask janitor` process runs a
+    pass each JANITOR_INTERVAL_SECONDS for all of them, or `flask purge-games` runs one from cron.  A pass
+    also removes abandoned image uploads.
+    """
+
+    def __init__(self, app=None):
+        self.retention_hours = 24
+        self.abandoned_hours = 72
+        self.batch_size = 100
+        self.interval_seconds = 600
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('GAME_RETENTION_HOURS', 24)
+        app.config.setdefault('GAME_ABANDONED_HOURS', 72)
+        app.config.setdefault('JANITOR_BATCH_SIZE', 100)
+        app.config.setdefault('JANITOR_INTERVAL_SECONDS', 600)
+        self.retention_hours = app.config['GAME_RETENTION_HOURS']
+        self.abandoned_hours = app.config['GAME_ABANDONED_HOURS']
+        self.batch_size = app.config['JANITOR_BATCH_SIZE']
+        self.interval_seconds = app.config['JANITOR_INTERVAL_SECONDS']
+
+    def expired_game_ids(self, now=None):
+        now = now or datetime.now()
+
+        def active_since(cutoff):
+            return or_(exists().where(and_(Player.game_id == Game.id, Player.time_joined >= cutoff)),
+                       exists().where(and_(PhraseSubmission.game_id == Game.id, PhraseSubmission.time >= cutoff)),
+                       exists().where(and_(ImageSubmission.game_id == Game.id, ImageSubmission.time >= cutoff)))
+
+        finished = and_(Game.state == 'GAME_OVER', ~active_since(now - timedelta(hours=self.retention_hours)))
+        abandoned = ~active_since(now - timedelta(hours=self.abandoned_hours))
+        return [game_id for (game_id,) in
+                db.session.query(Game.id).filter(or_(finished, abandoned)).order_by(Game.id).limit(self.batch_size)]
+
+    def purge(self, now=None):
+        """Deletes every expired game on every shard, a batch at a time, and returns how many there were."""
+        deleted = 0
+        for shard in shards.each():
+            while True:
+                game_ids = self.expired_game_ids(now)
+                deleted += delete_games(game_ids)
+                if len(game_ids) < self.batch_size:
+                    break
+        return deleted
+
+    def run_forever(self, app):
+        while True:
+            time.sleep(self.interval_seconds)
+            with app.app_context():
+                try:
+                    deleted = self.purge()
+                    if deleted:
+                        app.logger.info('Purged %d expired games', deleted)
+                    abandoned_uploads = image_store.uploads.purge()
+                    if abandoned_uploads:
+                        app.logger.info('Removed %d abandoned image uploads', abandoned_uploads)
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception('Could not purge expired games')
+                finally:
+                    db.session.remove()
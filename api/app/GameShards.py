@@ -0,0 +1,120 @@
+import bisect
+import hashlib
+from contextlib import contextmanager
+
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+
+# points per shard on the hash ring; more spread the games more evenly
+VIRTUAL_NODES = 64
+
+
+def ring_point(key):
+    return int.from_bytes(hashlib.sha256(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class ShardedSession(SignallingSession):
+    """Flask-SQLAlchemy's session, but the tables marked sharded (a game's own rows) go to the shard of the
+    game the session is on, set by GameShards.use().  Everything else, like stored images, stays on the
+    default database, or the replica of it the session reads from (see ReadReplicas)."""
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        shard = self.info.get('shard')
+        if shard is not None and mapper is not None and mapper.persist_selectable.info.get('sharded'):
+            return self.db.get_engine(self.app, bind=shard)
+        replica = self.info.get('replica')
+        if replica is not None:
+            return self.db.get_engine(self.app, bind=replica)
+        return super().get_bind(mapper, clause)
+
+
+class ShardedSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=ShardedSession, db=self, **options)
+
+
+class GameShards:
+    """Spreads games over several databases by game code.
+
+    The default database is the first shard and each of GAME_SHARD_URLS another, each holding the full
+    schema.  A game's shard is found by consistent hashing of its code, so adding a shard moves only the
+    games that now hash to it (about 1 in the new number of shards), and shards must only be appended.
+    Every query of a game goes through its code first (get_game_by_code, create_game and friends call use()),
+    after which the session sends the game's tables to that shard; work over many games, like the janitor's,
+    visits the shards one at a time with each().
+
+    A session is on one shard at a time.  Moving it flushes and forgets the objects it has loaded, since row
+    ids are only unique within a shard.
+    """
+
+    def __init__(self, db, app=None):
+        self.db = db
+        self.binds = [None]
+        self._ring = [(0, None)]
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('GAME_SHARD_URLS', [])
+        self.configure(app, app.config['GAME_SHARD_URLS'])
+
+    def configure(self, app, shard_urls):
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        for bind in self.binds[1:]:
+            binds.pop(bind, None)
+        self.binds = [None] + ['shard-' + str(number) for number in range(1, len(shard_urls) + 1)]
+        binds.update(zip(self.binds[1:], shard_urls))
+        app.config['SQLALCHEMY_BINDS'] = binds or None
+        self._ring = sorted((ring_point('shard-' + str(number) + '#' + str(node)), bind)
+                            for number, bind in enumerate(self.binds) for node in range(VIRTUAL_NODES))
+
+    def shard_for(self, game_code):
+        """The bind holding game_code's game; None for the default database."""
+        if len(self.binds) == 1:
+            return None
+        position = bisect.bisect(self._ring, (ring_point(game_code),))
+        return self._ring[position % len(self._ring)][1]
+
+    def use(self, game_code):
+        self.use_shard(self.shard_for(game_code))
+
+    def use_shard(self, shard):
+        session = self.db.session()
+        if session.info.get('shard') == shard:
+            return
+        if session.identity_map:
+            session.flush()
+            session.expunge_all()
+        session.info['shard'] = shard
+
+    def group(self, game_codes):
+        """game_codes by the shard they are on."""
+        shards = {}
+        for game_code in game_codes:
+            shards.setdefault(self.shard_for(game_code), []).append(game_code)
+        return shards
+
+    def each(self):
+        """Moves the session to each shard in turn, and back to where it was afterwards."""
+        with self._returning():
+            for shard in self.binds:
+                self.use_shard(shard)
+                yield shard
+
+    def create_all(self, app):
+        """Creates the games' tables on every shard but the default database, which migrations look after."""
+        tables = [table for table in self.db.Model.metadata.sorted_tables if table.info.get('sharded')]
+        for bind in self.binds[1:]:
+            self.db.Model.metadata.create_all(bind=self.db.get_engine(app, bind=bind), tables=tables)
+
+    @contextmanager
+    def _returning(self):
+        shard = self.db.session().info.get('shard')
+        try:
+            yield
+        finally:
+            self.use_shard(shard)
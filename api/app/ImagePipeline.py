@@ -0,0 +1,152 @@
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from app import db
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+THUMBNAIL_SUFFIX = '-thumbnail'
+# canvas exports are a few megapixels at most; refuse to decode anything that could exhaust memory
+MAX_PIXELS = 4096 * 4096
+
+
+def thumbnail_id_for(image_id, format):
+    return image_id.split('.', 1)[0] + THUMBNAIL_SUFFIX + '.' + format
+
+
+def open_image(data):
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.width * image.height > MAX_PIXELS:
+            return None
+        image.load()
+    except (IOError, SyntaxError, Image.DecompressionBombError):
+        return None
+    return image
+
+
+def recompress(image):
+    """Re-encodes a PNG as small as it goes without changing a single pixel: an opaque alpha channel is dropped,
+    drawings of at most 256 colours become palette images, and zlib runs at its best setting."""
+    candidate = image
+    if candidate.mode == 'RGBA' and candidate.getextrema()[3] == (255, 255):
+        candidate = candidate.convert('RGB')
+    if candidate.mode == 'RGB' and candidate.getcolors(256) is not None:
+        palette = candidate.convert('P', palette=Image.ADAPTIVE, colors=256)
+        if palette.convert('RGB').tobytes() == candidate.tobytes():
+            candidate = palette
+    output = io.BytesIO()
+    candidate.save(output, 'PNG', optimize=True)
+    return output.getvalue()
+
+
+def make_thumbnail(image, size, format):
+    thumbnail = image.copy()
+    thumbnail.thumbnail((size, size))
+    if thumbnail.mode not in ('RGB', 'RGBA'):
+        thumbnail = thumbnail.convert('RGBA')
+    output = io.BytesIO()
+    if format == 'webp':
+        thumbnail.save(output, 'WEBP', quality=80, method=6)
+    else:
+        thumbnail.save(output, 'PNG', optimize=True)
+    return output.getvalue()
+
+
+class ImagePipeline:
+    """Shrinks stored drawings after they are submitted, off the request thread.
+
+    Each new image is decoded once with Pillow: a PNG is losslessly recompressed and replaces the stored copy
+    only if it came out smaller, and a thumbnail no larger than IMAGE_THUMBNAIL_SIZE pixels is stored next to
+    it as IMAGE_THUMBNAIL_FORMAT ("webp" or "png").  Jobs run on IMAGE_PIPELINE_WORKERS threads, or inline
+    when that is 0.  Without Pillow, or with IMAGE_PIPELINE off, images are kept exactly as posted.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.enabled = False
+        self.thumbnail_size = 200
+        self.thumbnail_format = 'webp'
+        self._app = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    def init_app(self, app):
+        app.config.setdefault('IMAGE_PIPELINE', True)
+        app.config.setdefault('IMAGE_PIPELINE_WORKERS', 2)
+        app.config.setdefault('IMAGE_THUMBNAIL_SIZE', 200)
+        app.config.setdefault('IMAGE_THUMBNAIL_FORMAT', 'webp')
+        self._app = app
+        self.enabled = bool(app.config['IMAGE_PIPELINE']) and Image is not None
+        self.thumbnail_size = app.config['IMAGE_THUMBNAIL_SIZE']
+        self.thumbnail_format = app.config['IMAGE_THUMBNAIL_FORMAT']
+        if self.thumbnail_format not in ('webp', 'png'):
+            raise ValueError('Unknown IMAGE_THUMBNAIL_FORMAT "' + self.thumbnail_format + '".')
+        workers = app.config['IMAGE_PIPELINE_WORKERS']
+        if self.enabled and workers and self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-pipeline')
+
+    def thumbnail_id_for(self, image_id):
+        return thumbnail_id_for(image_id, self.thumbnail_format)
+
+    def submit(self, image_id):
+        """Queues image_id for processing.  Call after the image is committed, so the worker can read it."""
+        if not self.enabled:
+            return
+        if self._executor is None:
+            self._process_and_commit(image_id)
+            return
+        future = self._executor.submit(self._run, image_id)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+
+    def wait(self):
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending)
+
+    def _discard(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def _run(self, image_id):
+        # sessions are scoped to the thread, so the worker gets its own and must give its connection back
+        with self._app.app_context():
+            try:
+                self._process_and_commit(image_id)
+            finally:
+                db.session.remove()
+
+    def _process_and_commit(self, image_id):
+        try:
+            self.process(image_id)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self._app.logger.exception('Could not process image %s', image_id)
+
+    def process(self, image_id):
+        """Returns (bytes before, bytes after, thumbnail bytes), or None if there was nothing to do."""
+        thumbnail_id = self.thumbnail_id_for(image_id)
+        backend = self.store.backend
+        if backend.exists(thumbnail_id):
+            return None
+        stored = backend.open(image_id)
+        if stored is None:
+            return None
+        data = stored.read()
+        image = open_image(data)
+        if image is None:
+            return None
+        recompressed = recompress(image) if image.format == 'PNG' else data
+        if len(recompressed) < len(data):
+            backend.replace(image_id, recompressed)
+        thumbnail = make_thumbnail(image, self.thumbnail_size, self.thumbnail_format)
+        backend.put(thumbnail_id, thumbnail)
+        return len(data), min(len(data), len(recompressed)), len(thumbnail)
@@ -0,0 +1,235 @@
+import base64
+import binascii
+import hashlib
+import io
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+from urllib.parse import unquote_to_bytes
+
+from app import db
+from app.ImagePipeline import ImagePipeline, THUMBNAIL_SUFFIX
+from app.ImageUploads import COPY_BUFFER_BYTES, ImageUploads
+from app.StoredImage import StoredImage
+
+DEFAULT_CONTENT_TYPE = 'text/plain'
+# images per delete; with their thumbnails that stays under every database's bound-parameter limit
+DELETE_BATCH_SIZE = 400
+IMAGE_ID_PATTERN = re.compile(r'^[0-9a-f]{64}(' + THUMBNAIL_SUFFIX + r')?\.[0-9a-z+-]+$')
+
+# older mime.types files do not know WebP, which thumbnails are stored as
+mimetypes.add_type('image/webp', '.webp')
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def decode_data_url(image):
+    """Splits a posted canvas export ("data:image/png;base64,....") into its raw bytes and content type.
+
+    Anything that is not a data URL is kept verbatim as text.
+    """
+    if not isinstance(image, str):
+        raise InvalidImage('image must be a string.')
+    if not image.startswith('data:') or ',' not in image:
+        return image.encode('utf-8'), DEFAULT_CONTENT_TYPE
+    header, payload = image[len('data:'):].split(',', 1)
+    parameters = header.split(';')
+    content_type = parameters[0] or DEFAULT_CONTENT_TYPE
+    if not content_type.startswith('image/'):
+        raise InvalidImage('"' + content_type + '" is not an image type.')
+    if 'base64' in parameters[1:]:
+        try:
+            return base64.b64decode(payload, validate=True), content_type
+        except binascii.Error:
+            raise InvalidImage('image is not valid base64.')
+    return unquote_to_bytes(payload), content_type
+
+
+def image_id_for(data, content_type):
+    extension = mimetypes.guess_extension(content_type) or '.bin'
+    return hashlib.sha256(data).hexdigest() + extension
+
+
+def image_id_for_file(file, content_type):
+    digest = hashlib.sha256()
+    for buffer in iter(lambda: file.read(COPY_BUFFER_BYTES), b''):
+        digest.update(buffer)
+    return digest.hexdigest() + (mimetypes.guess_extension(content_type) or '.bin')
+
+
+def content_type_for(image_id):
+    return mimetypes.guess_type(image_id)[0] or 'application/octet-stream'
+
+
+class DatabaseImageBackend:
+    def exists(self, image_id):
+        return db.session.query(StoredImage.id).filter_by(id=image_id).scalar() is not None
+
+    def put(self, image_id, data):
+        db.session.add(StoredImage(image_id, data))
+
+    def put_file(self, image_id, file):
+        # a blob parameter is sent whole, so this one backend does read the image into memory
+        self.put(image_id, file.read())
+
+    def replace(self, image_id, data):
+        StoredImage.query.filter_by(id=image_id).update({'data': data}, synchronize_session=False)
+
+    def delete(self, image_ids):
+        StoredImage.query.filter(StoredImage.id.in_(image_ids)).delete(synchronize_session=False)
+
+    def open(self, image_id):
+        data = db.session.query(StoredImage.data).filter_by(id=image_id).scalar()
+        return None if data is None else io.BytesIO(data)
+
+
+class FilesystemImageBackend:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path_for(self, image_id):
+        return os.path.join(self.directory, image_id[:2], image_id)
+
+    def exists(self, image_id):
+        return os.path.exists(self.path_for(image_id))
+
+    def put(self, image_id, data):
+        self.put_file(image_id, io.BytesIO(data))
+
+    def put_file(self, image_id, file):
+        path = self.path_for(image_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(file_descriptor, 'wb') as temporary_file:
+            shutil.copyfileobj(file, temporary_file, COPY_BUFFER_BYTES)
+        os.replace(temporary_path, path)
+
+    replace = put
+
+    def delete(self, image_ids):
+        for image_id in image_ids:
+            try:
+                os.remove(self.path_for(image_id))
+            except FileNotFoundError:
+                pass
+
+    def open(self, image_id):
+        try:
+            return open(self.path_for(image_id), 'rb')
+        except FileNotFoundError:
+            return None
+
+
+class S3ImageBackend:
+    def __init__(self, bucket, endpoint_url=None):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError('IMAGE_STORE is "s3" but the boto3 package is not installed.')
+        self.bucket = bucket
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.client_error = ClientError
+        self.missing = self.client.exceptions.NoSuchKey
+
+    def exists(self, image_id):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=image_id)
+            return True
+        except self.client_error:
+            return False
+
+    def put(self, image_id, data):
+        self.client.put_object(Bucket=self.bucket, Key=image_id, Body=data, ContentType=content_type_for(image_id))
+
+    def put_file(self, image_id, file):
+        # sent in parts when large, so the image is never read into memory whole
+        self.client.upload_fileobj(file, self.bucket, image_id, ExtraArgs={'ContentType': content_type_for(image_id)})
+
+    replace = put
+
+    def delete(self, image_ids):
+        # DeleteObjects takes at most 1000 keys per call
+        for start in range(0, len(image_ids), 1000):
+            self.client.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': image_id} for image_id in image_ids[start:start + 1000]], 'Quiet': True})
+
+    def open(self, image_id):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=image_id)['Body']
+        except self.missing:
+            return None
+
+
+class ImageStore:
+    """Content-addressed storage for submitted drawings.
+
+    Images are decoded once on the way in and stored as raw bytes under "<sha256><extension>" of the bytes
+    posted, so identical drawings are stored once.  An id always shows the same picture, but not always in the
+    same bytes: the ImagePipeline swaps in a losslessly smaller copy under the same id, and adds a thumbnail.
+    IMAGE_STORE chooses where they live: "database" (a LONGBLOB table, the default), "filesystem"
+    (IMAGE_STORE_PATH) or "s3" (IMAGE_STORE_S3_BUCKET, optionally IMAGE_STORE_S3_ENDPOINT_URL for a local
+    S3-compatible server).  Images can also be sent in chunks through ImageUploads.
+    """
+
+    def __init__(self, app=None):
+        self.backend = DatabaseImageBackend()
+        self.pipeline = ImagePipeline(self)
+        self.uploads = ImageUploads()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IMAGE_STORE', 'database')
+        if not app.config.get('IMAGE_STORE_PATH'):
+            app.config['IMAGE_STORE_PATH'] = os.path.join(app.instance_path, 'images')
+        app.config.setdefault('IMAGE_STORE_S3_BUCKET', None)
+        app.config.setdefault('IMAGE_STORE_S3_ENDPOINT_URL', None)
+        kind = app.config['IMAGE_STORE']
+        if kind == 'database':
+            self.backend = DatabaseImageBackend()
+        elif kind == 'filesystem':
+            self.backend = FilesystemImageBackend(app.config['IMAGE_STORE_PATH'])
+        elif kind == 's3':
+            self.backend = S3ImageBackend(app.config['IMAGE_STORE_S3_BUCKET'], app.config['IMAGE_STORE_S3_ENDPOINT_URL'])
+        else:
+            raise ValueError('Unknown IMAGE_STORE "' + kind + '".')
+        self.pipeline.init_app(app)
+        self.uploads.init_app(app)
+
+    def decode(self, image, max_bytes):
+        """Decodes a posted image into its id and raw bytes, without storing it."""
+        data, content_type = decode_data_url(image)
+        if len(data) > max_bytes:
+            raise InvalidImage('image is larger than ' + str(max_bytes) + ' bytes.')
+        return image_id_for(data, content_type), data
+
+    def save(self, image_id, data):
+        """Stores decoded bytes under their id, unless an identical image already is, and returns the id."""
+        if not self.backend.exists(image_id):
+            self.backend.put(image_id, data)
+        return image_id
+
+    def save_file(self, file, content_type):
+        """Stores an image from a file of its raw bytes, a buffer at a time, and returns its id."""
+        image_id = image_id_for_file(file, content_type)
+        if not self.backend.exists(image_id):
+            file.seek(0)
+            self.backend.put_file(image_id, file)
+        return image_id
+
+    def open(self, image_id):
+        if not IMAGE_ID_PATTERN.match(image_id):
+            return None
+        return self.backend.open(image_id)
+
+    def delete(self, image_ids):
+        """Deletes images and their thumbnails.  Callers make sure no submission refers to them any more."""
+        image_ids = list(image_ids)
+        for start in range(0, len(image_ids), DELETE_BATCH_SIZE):
+            batch = image_ids[start:start + DELETE_BATCH_SIZE]
+            self.backend.delete(batch + [self.pipeline.thumbnail_id_for(image_id) for image_id in batch])
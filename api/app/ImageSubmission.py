@@ -1,28 +1,42 @@
 from datetime import datetime
 
+from flask import url_for
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.dialects.mysql import TEXT
 
 from app import db
+from app.PhraseSubmission import MAX_IDEMPOTENCY_KEY_LENGTH
 from app.Player import Player
+from app.StoredImage import MAX_IMAGE_ID_LENGTH
 
-MAX_IMAGE_LENGTH = 5242880
+MAX_IMAGE_BYTES = 5242880
 
 class ImageSubmission(db.Model):
+    # serves both the whole game's submissions and one player's latest (the prompt for the next player)
+    __table_args__ = (db.Index('ix_image_submission_game_id_player_id_id', 'game_id', 'player_id', 'id'),
+                      db.UniqueConstraint('player_id', 'idempotency_key',
+                                          name='uq_image_submission_player_id_idempotency_key'),
+                      {'info': {'sharded': True}})
+
     id = db.Column(db.Integer, primary_key=True)
     time = db.Column(db.DateTime(), nullable=False)
     game_id = db.Column(db.Integer, db.ForeignKey('game.id'))
     player_id = db.Column(db.Integer, db.ForeignKey('player.id'))
     player = db.relationship(Player, lazy='joined')
-    image = db.Column(TEXT(MAX_IMAGE_LENGTH), nullable=False)
+    image_id = db.Column(db.String(MAX_IMAGE_ID_LENGTH), nullable=False)
+    # set by clients that may retry, so a repeated post is recognised instead of saved twice
+    idempotency_key = db.Column(db.String(MAX_IDEMPOTENCY_KEY_LENGTH), nullable=True)
 
-    def __init__(self, player, image):
+    def __init__(self, player, image_id, idempotency_key=None):
         self.time = datetime.now()
         self.player = player
-        self.image = image
+        self.image_id = image_id
+        self.idempotency_key = idempotency_key
 
     def get_player(self):
         return self.player
 
     def get_image(self):
-        return self.image
+        return self.image_id
+
+    def get_image_url(self):
+        return url_for('get_image', image_id=self.image_id, _external=True)
@@ -0,0 +1,131 @@
+import fcntl
+import json
+import os
+import re
+import secrets
+import time
+
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+COPY_BUFFER_BYTES = 64 * 1024
+
+
+class UploadOffsetMismatch(ValueError):
+    def __init__(self, offset):
+        super().__init__('upload is at offset ' + str(offset) + '.')
+        self.offset = offset
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class UploadBusy(ValueError):
+    pass
+
+
+class ImageUploads:
+    """Images sent in chunks, so a drawing never has to be held in memory whole and a dropped connection
+    resumes where it stopped instead of starting over.
+
+    Each upload is a file under IMAGE_UPLOAD_PATH that chunks of at most IMAGE_UPLOAD_CHUNK_BYTES are
+    appended to in order, next to a small JSON file of who is uploading what.  A chunk is written holding an
+    exclusive lock on the file, and one arriving meanwhile is refused rather than waiting.  The chunks of an
+    upload must reach the same host, so several hosts need a shared IMAGE_UPLOAD_PATH or sticky sessions.
+    Uploads untouched for IMAGE_UPLOAD_EXPIRY_HOURS are removed by the GameJanitor.
+    """
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.max_chunk_bytes = 1024 * 1024
+        self.expiry_hours = 24
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('IMAGE_UPLOAD_PATH'):
+            app.config['IMAGE_UPLOAD_PATH'] = os.path.join(app.instance_path, 'uploads')
+        app.config.setdefault('IMAGE_UPLOAD_CHUNK_BYTES', 1024 * 1024)
+        app.config.setdefault('IMAGE_UPLOAD_EXPIRY_HOURS', 24)
+        self.directory = app.config['IMAGE_UPLOAD_PATH']
+        self.max_chunk_bytes = app.config['IMAGE_UPLOAD_CHUNK_BYTES']
+        self.expiry_hours = app.config['IMAGE_UPLOAD_EXPIRY_HOURS']
+
+    def create(self, details):
+        """Starts an empty upload described by details (a JSON-serialisable dict) and returns its id."""
+        os.makedirs(self.directory, exist_ok=True)
+        upload_id = secrets.token_hex(16)
+        with open(self._path(upload_id, '.json'), 'x') as details_file:
+            json.dump(details, details_file)
+        open(self._path(upload_id, '.part'), 'xb').close()
+        return upload_id
+
+    def details(self, upload_id):
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            return None
+        try:
+            with open(self._path(upload_id, '.json')) as details_file:
+                return json.load(details_file)
+        except FileNotFoundError:
+            return None
+
+    def size(self, upload_id):
+        """How many bytes have arrived, or None once the upload has been finished."""
+        try:
+            return os.path.getsize(self._path(upload_id, '.part'))
+        except FileNotFoundError:
+            return None
+
+    def append(self, upload_id, offset, stream, max_bytes):
+        """Writes a chunk read from stream at offset, which must be where the upload has got to, and returns
+        the new size.  A chunk that would take the upload past max_bytes is not kept."""
+        with open(self._path(upload_id, '.part'), 'r+b') as part:
+            try:
+                # two requests for the same offset would otherwise both pass the check below and both append
+                fcntl.flock(part.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadBusy('another chunk of this upload is being written.')
+            size = os.fstat(part.fileno()).st_size
+            if offset != size:
+                raise UploadOffsetMismatch(size)
+            part.seek(size)
+            received = 0
+            while True:
+                buffer = stream.read(COPY_BUFFER_BYTES)
+                if not buffer:
+                    return size + received
+                received += len(buffer)
+                if received > self.max_chunk_bytes or size + received > max_bytes:
+                    part.truncate(size)
+                    if received > self.max_chunk_bytes:
+                        raise UploadTooLarge('chunk is larger than ' + str(self.max_chunk_bytes) + ' bytes.')
+                    raise UploadTooLarge('image is larger than ' + str(max_bytes) + ' bytes.')
+                part.write(buffer)
+
+    def open(self, upload_id):
+        return open(self._path(upload_id, '.part'), 'rb')
+
+    def finish(self, upload_id):
+        # the details stay until the upload expires, so a retried finalize can still be recognised
+        try:
+            os.remove(self._path(upload_id, '.part'))
+        except FileNotFoundError:
+            pass
+
+    def purge(self, now=None):
+        """Removes uploads nobody has touched for IMAGE_UPLOAD_EXPIRY_HOURS and returns how many there were."""
+        if self.directory is None or not os.path.isdir(self.directory):
+            return 0
+        cutoff = (now or time.time()) - self.expiry_hours * 60 * 60
+        expired = set()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    expired.add(name.split('.', 1)[0])
+            except FileNotFoundError:
+                pass
+        return len(expired)
+
+    def _path(self, upload_id, suffix):
+        return os.path.join(self.directory, upload_id + suffix)
@@ -0,0 +1,161 @@
+import functools
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+from app import db, game_cache
+from app.Game import Game
+
+PREFIX = 'teledraw_'
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+INSTRUMENTED_GAME_METHODS = ['join', 'save_phrase', 'save_image', 'update_status_if_all_players_done',
+                             'commit_changes', 'compute_derived_state', 'get_summary', 'get_user_status',
+                             'get_phrase_prompt', 'get_image_prompt', 'get_all_submission_threads_indexed_by_user',
+                             'get_user_submission_thread', 'get_compact_results']
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(name + '="' + value + '"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = PREFIX + name
+        self.help = help
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, labels, value):
+        with self._lock:
+            counts = self._series.setdefault(labels, [0] * len(self.buckets) + [0, 0])
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render(self):
+        lines = ['# HELP ' + self.name + ' ' + self.help, '# TYPE ' + self.name + ' histogram']
+        with self._lock:
+            for labels, counts in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(self.name + '_bucket' + format_labels(labels + (('le', bound),)) + ' ' + str(count))
+                lines.append(self.name + '_bucket' + format_labels(labels + (('le', '+Inf'),)) + ' ' + str(counts[-1]))
+                lines.append(self.name + '_sum' + format_labels(labels) + ' ' + repr(counts[-2]))
+                lines.append(self.name + '_count' + format_labels(labels) + ' ' + str(counts[-1]))
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = PREFIX + name
+        self.help = help
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def add(self, labels, value):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + value
+
+    def render(self):
+        lines = ['# HELP ' + self.name + ' ' + self.help, '# TYPE ' + self.name + ' counter']
+        with self._lock:
+            lines += [self.name + format_labels(labels) + ' ' + str(value)
+                      for labels, value in sorted(self._series.items())]
+        return lines
+
+
+class Metrics:
+    """Opt-in request instrumentation, served in the Prometheus text format at /metrics.
+
+    With METRICS_ENABLED, every request records its latency, SQL statement count, bytes of SQL sent and bytes
+    of response by endpoint, and the hot Game methods record how long each call takes.  A request issuing
+    more than METRICS_QUERY_LOG_THRESHOLD statements is logged with all of them.  Figures are per worker
+    process, and a streamed response is measured up to the point its body starts.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.query_log_threshold = 50
+        self.request_seconds = Histogram('request_duration_seconds', 'Time to build each response.', DURATION_BUCKETS)
+        self.request_queries = Histogram('request_queries', 'SQL statements issued per request.', QUERY_COUNT_BUCKETS)
+        self.query_bytes = Counter('request_query_bytes_total', 'Bytes of SQL and parameters sent to the database.')
+        self.response_bytes = Counter('response_bytes_total', 'Bytes of response bodies with a known length.')
+        self.game_method_seconds = Histogram('game_method_duration_seconds', 'Time spent in each call of a Game '
+                                             'method, including the methods it calls.', DURATION_BUCKETS)
+        self._installed = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', False)
+        app.config.setdefault('METRICS_QUERY_LOG_THRESHOLD', 50)
+        self.enabled = app.config['METRICS_ENABLED']
+        self.query_log_threshold = app.config['METRICS_QUERY_LOG_THRESHOLD']
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        with app.app_context():
+            engines = [db.get_engine(app, bind) for bind in [None] + list(app.config['SQLALCHEMY_BINDS'] or [])]
+        for engine in engines:
+            if not event.contains(engine, 'before_cursor_execute', self._count_query):
+                event.listen(engine, 'before_cursor_execute', self._count_query)
+        if not self._installed:
+            self._installed = True
+            for name in INSTRUMENTED_GAME_METHODS:
+                setattr(Game, name, self._timed(name, getattr(Game, name)))
+
+    def render(self):
+        lines = []
+        for metric in [self.request_seconds, self.request_queries, self.query_bytes, self.response_bytes,
+                       self.game_method_seconds]:
+            lines += metric.render()
+        for name, value in sorted(game_cache.stats().items()):
+            if name in ('hits', 'misses', 'invalidations', 'evictions'):
+                lines += ['# TYPE ' + PREFIX + 'game_cache_' + name + '_total counter',
+                          PREFIX + 'game_cache_' + name + '_total ' + str(value)]
+        return '\n'.join(lines) + '\n'
+
+    def _timed(self, name, method):
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            if not self.enabled:
+                return method(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.game_method_seconds.observe((('method', name),), time.perf_counter() - started)
+        return timed
+
+    def _start_request(self):
+        if self.enabled:
+            g.metrics_started = time.perf_counter()
+            g.metrics_queries = []
+
+    def _count_query(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and g.get('metrics_queries') is not None:
+            g.metrics_queries.append(statement)
+            g.metrics_query_bytes = g.get('metrics_query_bytes', 0) + len(statement) + len(repr(parameters))
+
+    def _finish_request(self, response):
+        queries = g.get('metrics_queries')
+        if queries is None:
+            return response
+        labels = (('endpoint', request.endpoint or 'unmatched'), ('method', request.method))
+        self.request_seconds.observe(labels, time.perf_counter() - g.metrics_started)
+        self.request_queries.observe(labels, len(queries))
+        self.query_bytes.add(labels, g.get('metrics_query_bytes', 0))
+        if response.content_length is not None:
+            self.response_bytes.add(labels, response.content_length)
+        if len(queries) > self.query_log_threshold:
+            current_app.logger.warning('%s %s issued %d SQL statements:\n%s', request.method, request.full_path,
+                                       len(queries), '\n'.join(queries))
+        g.metrics_queries = None
+        return response
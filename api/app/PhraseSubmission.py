@@ -6,19 +6,29 @@ from app import db
 from app.Player import Player
 
 MAX_PHRASE_LENGTH = 2048
+MAX_IDEMPOTENCY_KEY_LENGTH = 64
 
 class PhraseSubmission(db.Model):
+    # serves both the whole game's submissions and one player's latest (the prompt for the next player)
+    __table_args__ = (db.Index('ix_phrase_submission_game_id_player_id_id', 'game_id', 'player_id', 'id'),
+                      db.UniqueConstraint('player_id', 'idempotency_key',
+                                          name='uq_phrase_submission_player_id_idempotency_key'),
+                      {'info': {'sharded': True}})
+
     id = db.Column(db.Integer, primary_key=True)
     time = db.Column(db.DateTime(), nullable=False)
     game_id = db.Column(db.Integer, db.ForeignKey('game.id'))
     player_id = db.Column(db.Integer, db.ForeignKey('player.id'))
     player = db.relationship(Player, lazy='joined')
     phrase = db.Column(db.String(MAX_PHRASE_LENGTH), nullable=False)
+    # set by clients that may retry, so a repeated post is recognised instead of saved twice
+    idempotency_key = db.Column(db.String(MAX_IDEMPOTENCY_KEY_LENGTH), nullable=True)
 
-    def __init__(self, player, phrase):
+    def __init__(self, player, phrase, idempotency_key=None):
         self.time = datetime.now()
         self.player = player
         self.phrase = phrase
+        self.idempotency_key = idempotency_key
 
     def get_player(self):
         return self.player
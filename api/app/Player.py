@@ -3,18 +3,25 @@ from datetime import datetime
 from app import db
 
 MAX_LENGTH = 256
+MAX_STATUS_LENGTH = 32
 
 class Player(db.Model):
+    # every read of a game loads its players in seat order
+    __table_args__ = (db.Index('ix_player_game_id_seat', 'game_id', 'seat'), {'info': {'sharded': True}})
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(MAX_LENGTH), nullable=False)
-    status = db.Column(db.String(MAX_LENGTH), nullable=False)
+    status = db.Column(db.String(MAX_STATUS_LENGTH), nullable=False)
     time_joined = db.Column(db.DateTime(), nullable=False)
     game_id = db.Column(db.Integer, db.ForeignKey('game.id'), nullable=False)
+    # position in the passing order, counted from 0 in order of joining
+    seat = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
-    def __init__(self, username):
+    def __init__(self, username, seat=0):
         self.name = username
         self.status = "SUBMIT_INITIAL_PHRASE"
         self.time_joined = datetime.now()
+        self.seat = seat
 
     def get_name(self):
         return self.name
@@ -0,0 +1,88 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# games remembered as recently changed; older ones are forgotten first
+MAX_RECENT_CHANGES = 10000
+
+
+class ReadReplicas:
+    """Sends the polling endpoints' reads to replicas of the default database, keeping writes on it.
+
+    GAME_REPLICA_URLS lists the replicas; a read picks one at random.  Replicas lag, so two things keep
+    clients from going back in time:
+
+    * A game that changed in the last GAME_REPLICA_LAG_SECONDS is read from the primary, which also keeps
+      states older than the change out of the GameCache.  Set it above the replicas' usual lag.
+    * A client that has seen a newer version of the game than a replica has (it passes the X-Game-Version
+      it got, from a poll or its own join or submission, as ?since=) is answered from the primary.
+
+    Games on shards other than the default database are read from their shard (see GameShards).
+    """
+
+    def __init__(self, db, app=None):
+        self.db = db
+        self.binds = []
+        self.lag_seconds = 2
+        self._lock = threading.Lock()
+        self._changed = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, events=None):
+        app.config.setdefault('GAME_REPLICA_URLS', [])
+        app.config.setdefault('GAME_REPLICA_LAG_SECONDS', 2)
+        self.lag_seconds = app.config['GAME_REPLICA_LAG_SECONDS']
+        self.configure(app, app.config['GAME_REPLICA_URLS'])
+        if events is not None:
+            events.add_listener(self.changed)
+
+    def configure(self, app, replica_urls):
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        for bind in self.binds:
+            binds.pop(bind, None)
+        self.binds = ['replica-' + str(number) for number in range(1, len(replica_urls) + 1)]
+        binds.update(zip(self.binds, replica_urls))
+        app.config['SQLALCHEMY_BINDS'] = binds or None
+
+    def changed(self, game_code):
+        with self._lock:
+            self._changed.pop(game_code, None)
+            self._changed[game_code] = time.monotonic()
+            while len(self._changed) > MAX_RECENT_CHANGES:
+                del self._changed[next(iter(self._changed))]
+
+    def replica_for(self, game_code):
+        """The bind to read game_code from, or None for the primary."""
+        if not self.binds:
+            return None
+        with self._lock:
+            changed = self._changed.get(game_code)
+        if changed is not None and time.monotonic() - changed < self.lag_seconds:
+            return None
+        return random.choice(self.binds)
+
+    @contextmanager
+    def reading(self, game_code):
+        """Sends the session's reads to a replica for the block when game_code may be read from one, and
+        yields whether it does."""
+        replica = self.replica_for(game_code)
+        self._use(replica)
+        try:
+            yield replica is not None
+        finally:
+            self._use(None)
+
+    def use_primary(self):
+        self._use(None)
+
+    def _use(self, replica):
+        session = self.db.session()
+        if session.info.get('replica') == replica:
+            return
+        # the same rows, but not necessarily at the same version
+        if session.identity_map:
+            session.flush()
+            session.expunge_all()
+        session.info['replica'] = replica
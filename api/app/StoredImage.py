@@ -0,0 +1,13 @@
+from sqlalchemy.dialects.mysql import LONGBLOB
+
+from app import db
+
+MAX_IMAGE_ID_LENGTH = 80
+
+class StoredImage(db.Model):
+    id = db.Column(db.String(MAX_IMAGE_ID_LENGTH), primary_key=True)
+    data = db.deferred(db.Column(db.LargeBinary().with_variant(LONGBLOB, 'mysql'), nullable=False))
+
+    def __init__(self, image_id, data):
+        self.id = image_id
+        self.data = data
@@ -0,0 +1,4 @@
+from app import create_app
+from app.EventStreams import EventStreamApp
+
+app = EventStreamApp(create_app())
@@ -0,0 +1,13 @@
+import os
+
+# Production serving profile: `gunicorn asgi:app` picks this file up from the api directory.
+# Uvicorn workers, so an open event stream costs a coroutine rather than a thread; Flask requests and event renders run
+# on each worker's ASGI_THREADS threads (see app/Config.py).
+# Workers hear of each other's changes only through GAME_EVENTS_REDIS_URL: without it, streams and caches on one
+# worker never learn that another worker advanced a round, so WEB_CONCURRENCY is ignored and one worker serves all.
+bind = '0.0.0.0:' + os.environ.get('PORT', '8080')
+workers = int(os.environ.get('WEB_CONCURRENCY', 4)) if os.environ.get('GAME_EVENTS_REDIS_URL') else 1
+worker_class = 'uvicorn.workers.UvicornWorker'
+keepalive = 5
+timeout = 30
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')
@@ -0,0 +1,66 @@
+"""store game round state
+
+Revision ID: 5d9a3b6e8f21
+Revises: c42d7e1f6a93
+Create Date: 2026-10-18 10:00:00.000000
+
+Backfills state, phase and the submission counters of existing games from their submissions.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d9a3b6e8f21'
+down_revision = 'c42d7e1f6a93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('game') as batch_op:
+        batch_op.add_column(sa.Column('state', sa.String(length=32), server_default='WAITING_FOR_PLAYERS',
+                                      nullable=False))
+        batch_op.add_column(sa.Column('phase', sa.Integer(), server_default='1', nullable=False))
+        batch_op.add_column(sa.Column('phrase_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('image_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('round_submission_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.create_index(batch_op.f('ix_game_state'), ['state'], unique=False)
+
+    connection = op.get_bind()
+    game = sa.table('game', sa.column('id'), sa.column('state'), sa.column('phase'), sa.column('phrase_count'),
+                    sa.column('image_count'), sa.column('round_submission_count'))
+
+    def counts_by_game(table_name):
+        table = sa.table(table_name, sa.column('game_id'))
+        return dict(connection.execute(
+            sa.select([table.c.game_id, sa.func.count()]).group_by(table.c.game_id)).fetchall())
+
+    players = counts_by_game('player')
+    phrases = counts_by_game('phrase_submission')
+    images = counts_by_game('image_submission')
+    for (game_id,) in connection.execute(sa.select([game.c.id])).fetchall():
+        number_of_players = players.get(game_id, 0)
+        phrase_count = phrases.get(game_id, 0)
+        image_count = images.get(game_id, 0)
+        submission_count = phrase_count + image_count
+        completed_rounds = submission_count // number_of_players if number_of_players else 0
+        if number_of_players and submission_count >= number_of_players ** 2:
+            state = 'GAME_OVER'
+        elif phrase_count > 0:
+            state = 'IN_PROGRESS'
+        else:
+            state = 'WAITING_FOR_PLAYERS'
+        connection.execute(game.update().where(game.c.id == game_id).values(
+            state=state, phase=1 + completed_rounds, phrase_count=phrase_count, image_count=image_count,
+            round_submission_count=submission_count - completed_rounds * number_of_players))
+
+
+def downgrade():
+    with op.batch_alter_table('game') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_game_state'))
+        batch_op.drop_column('round_submission_count')
+        batch_op.drop_column('image_count')
+        batch_op.drop_column('phrase_count')
+        batch_op.drop_column('phase')
+        batch_op.drop_column('state')
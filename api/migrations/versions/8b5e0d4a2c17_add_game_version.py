@@ -0,0 +1,25 @@
+"""add game state version
+
+Revision ID: 8b5e0d4a2c17
+Revises: 3f1c2a7d9b40
+Create Date: 2026-10-18 08:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b5e0d4a2c17'
+down_revision = '3f1c2a7d9b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('game', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('game') as batch_op:
+        batch_op.drop_column('version')
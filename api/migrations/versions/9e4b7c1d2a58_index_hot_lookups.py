@@ -0,0 +1,62 @@
+"""index hot lookups
+
+Revision ID: 9e4b7c1d2a58
+Revises: 5d9a3b6e8f21
+Create Date: 2026-10-18 12:00:00.000000
+
+Adds player.seat (backfilled from join order) with a (game_id, seat) index, narrows player.status, and
+indexes both submission tables by (game_id, player_id, id).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b7c1d2a58'
+down_revision = '5d9a3b6e8f21'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade():
+    with op.batch_alter_table('player') as batch_op:
+        batch_op.add_column(sa.Column('seat', sa.Integer(), server_default='0', nullable=False))
+        batch_op.alter_column('status', existing_type=sa.String(length=256), type_=sa.String(length=32),
+                              existing_nullable=False)
+        batch_op.create_index('ix_player_game_id_seat', ['game_id', 'seat'], unique=False)
+    with op.batch_alter_table('phrase_submission') as batch_op:
+        batch_op.create_index('ix_phrase_submission_game_id_player_id_id', ['game_id', 'player_id', 'id'],
+                              unique=False)
+    with op.batch_alter_table('image_submission') as batch_op:
+        batch_op.create_index('ix_image_submission_game_id_player_id_id', ['game_id', 'player_id', 'id'],
+                              unique=False)
+
+    # players were always ordered by id, so that is the seat order of every existing game
+    connection = op.get_bind()
+    player = sa.table('player', sa.column('id'), sa.column('game_id'), sa.column('seat'))
+    update = player.update().where(player.c.id == sa.bindparam('player_id')).values(seat=sa.bindparam('new_seat'))
+    seats, previous_game_id, seat = [], None, 0
+    for player_id, game_id in connection.execute(
+            sa.select([player.c.id, player.c.game_id]).order_by(player.c.game_id, player.c.id)).fetchall():
+        seat = seat + 1 if game_id == previous_game_id else 0
+        previous_game_id = game_id
+        seats.append({'player_id': player_id, 'new_seat': seat})
+        if len(seats) == BATCH_SIZE:
+            connection.execute(update, seats)
+            seats = []
+    if seats:
+        connection.execute(update, seats)
+
+
+def downgrade():
+    with op.batch_alter_table('image_submission') as batch_op:
+        batch_op.drop_index('ix_image_submission_game_id_player_id_id')
+    with op.batch_alter_table('phrase_submission') as batch_op:
+        batch_op.drop_index('ix_phrase_submission_game_id_player_id_id')
+    with op.batch_alter_table('player') as batch_op:
+        batch_op.drop_index('ix_player_game_id_seat')
+        batch_op.alter_column('status', existing_type=sa.String(length=32), type_=sa.String(length=256),
+                              existing_nullable=False)
+        batch_op.drop_column('seat')
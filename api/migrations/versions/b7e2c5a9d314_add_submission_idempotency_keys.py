@@ -0,0 +1,33 @@
+"""add submission idempotency keys
+
+Revision ID: b7e2c5a9d314
+Revises: 9e4b7c1d2a58
+Create Date: 2026-10-18 14:00:00.000000
+
+Lets clients tag a phrase or image post with an Idempotency-Key, unique per player, so that a retried post
+is recognised instead of saved twice.  Existing submissions have none.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2c5a9d314'
+down_revision = '9e4b7c1d2a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ['phrase_submission', 'image_submission']:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column('idempotency_key', sa.String(length=64), nullable=True))
+            batch_op.create_unique_constraint('uq_' + table + '_player_id_idempotency_key',
+                                              ['player_id', 'idempotency_key'])
+
+
+def downgrade():
+    for table in ['image_submission', 'phrase_submission']:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_constraint('uq_' + table + '_player_id_idempotency_key', type_='unique')
+            batch_op.drop_column('idempotency_key')
@@ -0,0 +1,90 @@
+"""store images as binary, content-addressed
+
+Revision ID: c42d7e1f6a93
+Revises: 8b5e0d4a2c17
+Create Date: 2026-10-18 09:00:00.000000
+
+Existing data URLs are decoded into the stored_image table (the "database" image store).
+Deployments using another IMAGE_STORE should copy those rows across after upgrading.
+"""
+import base64
+import hashlib
+import mimetypes
+from urllib.parse import unquote_to_bytes
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c42d7e1f6a93'
+down_revision = '8b5e0d4a2c17'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 100
+
+
+def decode(image):
+    if not image.startswith('data:') or ',' not in image:
+        return image.encode('utf-8'), 'text/plain'
+    header, payload = image[len('data:'):].split(',', 1)
+    parameters = header.split(';')
+    data = base64.b64decode(payload) if 'base64' in parameters[1:] else unquote_to_bytes(payload)
+    return data, parameters[0] or 'text/plain'
+
+
+def upgrade():
+    stored_image = op.create_table('stored_image',
+    sa.Column('id', sa.String(length=80), nullable=False),
+    sa.Column('data', sa.LargeBinary().with_variant(mysql.LONGBLOB(), 'mysql'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.add_column('image_submission', sa.Column('image_id', sa.String(length=80), nullable=True))
+
+    connection = op.get_bind()
+    image_submission = sa.table('image_submission', sa.column('id'), sa.column('image'), sa.column('image_id'))
+    stored_ids = set()
+    last_id = 0
+    while True:
+        rows = connection.execute(sa.select([image_submission.c.id, image_submission.c.image])
+                                  .where(image_submission.c.id > last_id)
+                                  .order_by(image_submission.c.id).limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        for submission_id, image in rows:
+            data, content_type = decode(image)
+            image_id = hashlib.sha256(data).hexdigest() + (mimetypes.guess_extension(content_type) or '.bin')
+            if image_id not in stored_ids:
+                connection.execute(stored_image.insert().values(id=image_id, data=data))
+                stored_ids.add(image_id)
+            connection.execute(image_submission.update().where(image_submission.c.id == submission_id)
+                               .values(image_id=image_id))
+        last_id = rows[-1][0]
+
+    with op.batch_alter_table('image_submission') as batch_op:
+        batch_op.alter_column('image_id', existing_type=sa.String(length=80), nullable=False)
+        batch_op.drop_column('image')
+
+
+def downgrade():
+    with op.batch_alter_table('image_submission') as batch_op:
+        batch_op.add_column(sa.Column('image', sa.Text().with_variant(mysql.TEXT(length=5242880), 'mysql'),
+                                      nullable=True))
+
+    connection = op.get_bind()
+    image_submission = sa.table('image_submission', sa.column('id'), sa.column('image'), sa.column('image_id'))
+    stored_image = sa.table('stored_image', sa.column('id'), sa.column('data'))
+    rows = connection.execute(sa.select([image_submission.c.id, image_submission.c.image_id])).fetchall()
+    for submission_id, image_id in rows:
+        data = connection.execute(sa.select([stored_image.c.data]).where(stored_image.c.id == image_id)).scalar()
+        content_type = mimetypes.guess_type(image_id)[0]
+        image = data.decode('utf-8') if content_type == 'text/plain' else \
+            'data:' + content_type + ';base64,' + base64.b64encode(data).decode('ascii')
+        connection.execute(image_submission.update().where(image_submission.c.id == submission_id).values(image=image))
+
+    with op.batch_alter_table('image_submission') as batch_op:
+        batch_op.alter_column('image', existing_type=sa.Text(), nullable=False)
+        batch_op.drop_column('image_id')
+    op.drop_table('stored_image')
@@ -0,0 +1,156 @@
+"""Holds thousands of idle event streams open and measures memory per connection and push latency.
+
+The API is started in a subprocess against a temporary SQLite database, served either over ASGI
+(`uvicorn asgi:app`) or by the threaded WSGI profile (`gunicorn wsgi:app` with one gthread worker and a
+thread per client).  --clients event streams are opened on one game, then players submit their first
+phrases one at a time and every stream is timed until it receives the change.
+
+Run from the api directory:  python -m tests.bench_event_streams [--server asgi] [--clients 2000] [--rounds 5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from app import create_app, db
+
+CONNECT_BATCH = 200
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def server_command(server, port, clients):
+    if server == 'asgi':
+        return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(port), '--log-level', 'warning',
+                '--no-access-log', '--backlog', str(clients)]
+    return [sys.executable, '-m', 'gunicorn', 'wsgi:app', '--bind', '127.0.0.1:' + str(port), '--workers', '1',
+            '--worker-class', 'gthread', '--threads', str(clients + 16), '--worker-connections', str(clients + 16),
+            '--backlog', str(clients)]
+
+
+def resident_kilobytes(pid):
+    """Resident memory of a process and all of its children (gunicorn serves from a forked worker)."""
+    total = 0
+    with open('/proc/{}/status'.format(pid)) as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                total += int(line.split()[1])
+    for task in os.listdir('/proc/{}/task'.format(pid)):
+        with open('/proc/{}/task/{}/children'.format(pid, task)) as children:
+            total += sum(resident_kilobytes(int(child)) for child in children.read().split())
+    return total
+
+
+def post(base_url, path, body):
+    request = urllib.request.Request(base_url + path, data=json.dumps(body).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    urllib.request.urlopen(request).read()
+
+
+def wait_until_serving(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(base_url + '/').read()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+async def open_stream(port, path):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write('GET {} HTTP/1.0\r\nHost: 127.0.0.1\r\n\r\n'.format(path).encode('ascii'))
+    await wait_for_event(reader)
+    return reader, writer
+
+
+async def wait_for_event(reader):
+    received = b''
+    while b'event: ' not in received:
+        chunk = await reader.read(65536)
+        if not chunk:
+            raise ConnectionError('stream closed')
+        received += chunk
+
+
+async def timed_event(reader, started):
+    await wait_for_event(reader)
+    return time.perf_counter() - started[0]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run(args, port, pid, base_url):
+    loop = asyncio.get_event_loop()
+    idle_kilobytes = resident_kilobytes(pid)
+    path = '/game/bench/events?username=player0'
+    connect_started = time.perf_counter()
+    streams = []
+    for start in range(0, args.clients, CONNECT_BATCH):
+        batch = min(CONNECT_BATCH, args.clients - start)
+        streams += await asyncio.gather(*(open_stream(port, path) for _ in range(batch)))
+    connect_seconds = time.perf_counter() - connect_started
+    await asyncio.sleep(1)
+    connected_kilobytes = resident_kilobytes(pid)
+
+    latencies = []
+    for round_number in range(args.rounds):
+        started = [0]
+        waiting = [asyncio.ensure_future(timed_event(reader, started)) for reader, _ in streams]
+        await asyncio.sleep(0.5)
+        started[0] = time.perf_counter()
+        await loop.run_in_executor(None, post, base_url, '/phrase', {
+            'username': 'player' + str(round_number + 1), 'game': 'bench', 'phrase': 'phrase ' + str(round_number)})
+        latencies += await asyncio.gather(*waiting)
+    for _, writer in streams:
+        writer.close()
+
+    print('{} server, {} streams (connected in {:.1f} s)'.format(args.server, args.clients, connect_seconds))
+    print('  resident memory: {:.1f} MB idle, {:.1f} MB with streams open, {:.1f} KB per stream'.format(
+        idle_kilobytes / 1024, connected_kilobytes / 1024, (connected_kilobytes - idle_kilobytes) / args.clients))
+    print('  push latency over {} changes: p50 {:.0f} ms, p99 {:.0f} ms, max {:.0f} ms'.format(
+        args.rounds, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000, max(latencies) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--server', choices=['asgi', 'wsgi'], default='asgi')
+    parser.add_argument('--clients', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    database_url = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    with create_app({'SQLALCHEMY_DATABASE_URI': database_url}).app_context():
+        db.create_all()
+    port = free_port()
+    base_url = 'http://127.0.0.1:' + str(port)
+    environment = dict(os.environ, DATABASE_URL=database_url, IMAGE_STORE_PATH=os.path.join(directory, 'images'))
+    server = subprocess.Popen(server_command(args.server, port, args.clients), env=environment)
+    try:
+        wait_until_serving(base_url)
+        for seat in range(args.rounds + 2):
+            post(base_url, '/join', {'username': 'player' + str(seat), 'game': 'bench'})
+        asyncio.get_event_loop().run_until_complete(run(args, port, server.pid, base_url))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
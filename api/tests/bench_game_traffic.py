@@ -0,0 +1,191 @@
+"""Plays concurrent games through the API the way browsers do and reports latency per endpoint.
+
+--rooms games of --players players each are played at once, one thread per room.  Every player joins, then
+polls the game summary and its own status every --poll-seconds (as the frontend does when it cannot stream),
+fetches each image it is asked to describe, and submits --think-seconds after being asked to.  Images are
+random payloads of --image-kb (the size range of real canvas exports).  Once a game is over every player
+fetches the results.  The arrival rate is set by the polling, so lower --poll-seconds to look for the
+throughput ceiling.
+
+The app runs in this process against a temporary SQLite database, or the scratch database in --database-url
+(e.g. a local MySQL; tables are created and the benchmark's games are deleted afterwards).  Bytes read are
+counted from the SQLite cursors, or from MySQL's Bytes_sent status counter.
+
+Run from the api directory:  flask bench [--rooms 10] [--players 8] [--database-url mysql://...]
+                         or  python -m tests.bench_game_traffic [same options]
+"""
+import argparse
+import base64
+import heapq
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+from sqlalchemy import text
+
+from app import create_app, db, delete_games, shards
+from app.Game import Game
+from tests.bench_poll_bytes import ByteCountingConnection, ByteCountingCursor
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, endpoint, seconds, status_code):
+        with self.lock:
+            self.seconds[endpoint].append(seconds)
+            if status_code >= 400:
+                self.errors[endpoint] += 1
+
+
+class Room:
+    """One game's players, driven from a single thread by a schedule of (due time, action, player)."""
+
+    def __init__(self, app, code, args, recorder, seed):
+        self.app = app
+        self.code = code
+        self.args = args
+        self.recorder = recorder
+        self.random = random.Random(seed)
+        self.players = ['player' + str(seat) for seat in range(args.players)]
+        self.finished = False
+
+    def request(self, client, endpoint, method, path, **kwargs):
+        started = time.perf_counter()
+        response = client.open(path, method=method, **kwargs)
+        response.get_data()
+        self.recorder.record(endpoint, time.perf_counter() - started, response.status_code)
+        return response
+
+    def run(self, deadline):
+        client = self.app.test_client()
+        for player in self.players:
+            self.request(client, 'POST /join', 'POST', '/join', json={'username': player, 'game': self.code})
+        now = time.perf_counter()
+        schedule = [(now + self.random.uniform(0, self.args.poll_seconds), 'poll', player) for player in self.players]
+        heapq.heapify(schedule)
+        submitting, done = set(), set()
+        while schedule and time.perf_counter() < deadline:
+            due, action, player = heapq.heappop(schedule)
+            time.sleep(max(0, due - time.perf_counter()))
+            if action == 'poll':
+                self.request(client, 'GET /game/<code>', 'GET', '/game/' + self.code)
+                status = self.request(client, 'GET /game/<code>/player/<username>', 'GET',
+                                      '/game/' + self.code + '/player/' + player).get_json()
+                if status['description'] == 'GAME_OVER':
+                    self.request(client, 'GET /game/<code>/results', 'GET', '/game/' + self.code + '/results')
+                    done.add(player)
+                    continue
+                if status['description'].startswith('SUBMIT') and player not in submitting:
+                    submitting.add(player)
+                    if status['description'] == 'SUBMIT_PHRASE':
+                        self.request(client, 'GET /image/<id>', 'GET', urlparse(status['prompt']).path)
+                    action = 'image' if status['description'] == 'SUBMIT_IMAGE' else 'phrase'
+                    heapq.heappush(schedule, (time.perf_counter() + self.random.uniform(*self.args.think_seconds),
+                                              action, player))
+                heapq.heappush(schedule, (due + self.args.poll_seconds, 'poll', player))
+            elif action == 'phrase':
+                submitting.discard(player)
+                self.request(client, 'POST /phrase', 'POST', '/phrase', json={
+                    'username': player, 'game': self.code, 'phrase': 'a phrase from ' + player})
+            else:
+                submitting.discard(player)
+                self.request(client, 'POST /image', 'POST', '/image', json={
+                    'username': player, 'game': self.code, 'image': self.drawing()})
+        self.finished = len(done) == len(self.players)
+
+    def drawing(self):
+        size = int(self.random.uniform(*self.args.image_kb) * 1024)
+        return 'data:image/png;base64,' + base64.b64encode(os.urandom(size)).decode('ascii')
+
+
+def delete_bench_games(codes):
+    for shard, shard_codes in shards.group(codes).items():
+        shards.use_shard(shard)
+        delete_games([game_id for (game_id,) in db.session.query(Game.id).filter(Game.code.in_(shard_codes))])
+
+
+def database_bytes_read(dialect):
+    if dialect == 'sqlite':
+        return ByteCountingCursor.bytes_read
+    if dialect == 'mysql':
+        return int(db.session.execute(text("SHOW GLOBAL STATUS LIKE 'Bytes_sent'")).fetchone()[1])
+    return None
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def report(args, dialect, recorder, seconds, bytes_read, finished_rooms):
+    total = sum(len(values) for values in recorder.seconds.values())
+    print('{} rooms x {} players on {}: {:,} requests in {:.1f} s, {:,.1f} requests/s, {} of {} games finished'.format(
+        args.rooms, args.players, dialect, total, seconds, total / seconds, finished_rooms, args.rooms))
+    print('  {:<36} {:>7} {:>7} {:>8} {:>8} {:>8}'.format('endpoint', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for endpoint, values in sorted(recorder.seconds.items()):
+        print('  {:<36} {:>7,} {:>7,} {:>8.1f} {:>8.1f} {:>8.1f}'.format(
+            endpoint, len(values), recorder.errors[endpoint], percentile(values, 0.5) * 1000,
+            percentile(values, 0.95) * 1000, percentile(values, 0.99) * 1000))
+    if bytes_read is None:
+        print('  database bytes read: not measured for ' + dialect)
+    else:
+        print('  database bytes read: {:,.1f} MB, {:,.0f} bytes per request'.format(
+            bytes_read / 1024 / 1024, bytes_read / max(total, 1)))
+
+
+def run(args, database_url):
+    config = {'SQLALCHEMY_DATABASE_URI': database_url}
+    if database_url.startswith('sqlite'):
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'factory': ByteCountingConnection}}
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        dialect = db.engine.dialect.name
+        recorder = Recorder()
+        codes = ['bench-{}-{}'.format(args.seed, number) for number in range(args.rooms)]
+        delete_bench_games(codes)
+        rooms = [Room(app, code, args, recorder, seed=args.seed * 100000 + number)
+                 for number, code in enumerate(codes)]
+        threads = [threading.Thread(target=room.run, args=(time.perf_counter() + args.seconds,)) for room in rooms]
+        bytes_before = database_bytes_read(dialect)
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - started
+        bytes_after = database_bytes_read(dialect)
+        report(args, dialect, recorder, seconds, None if bytes_after is None else bytes_after - bytes_before,
+               sum(room.finished for room in rooms))
+        delete_bench_games(codes)
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description=__doc__.splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--players', type=int, default=8)
+    parser.add_argument('--poll-seconds', type=float, default=2.0)
+    parser.add_argument('--think-seconds', type=float, nargs=2, default=[1.0, 4.0])
+    parser.add_argument('--image-kb', type=float, nargs=2, default=[30.0, 220.0])
+    parser.add_argument('--seconds', type=float, default=600, help='stop games still running after this long')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database-url', help='a scratch database; a temporary SQLite file by default')
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        run(args, args.database_url)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            run(args, 'sqlite:///' + os.path.join(directory, 'bench.db'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Reports stored bytes per image before and after the image pipeline, on a corpus of sample drawings.
+
+Each drawing is an 800x600 canvas export like the ones the frontend posts: a white background with random
+pen strokes, either hard-edged in a few colours or anti-aliased (drawn at twice the size and scaled down, as
+browsers do).  Every drawing is run through the same recompression and thumbnailing the pipeline applies.
+Needs Pillow.
+
+Run from the api directory:  python -m tests.bench_images [--drawings 20] [--strokes 40] [--seed 1]
+"""
+import argparse
+import io
+import random
+
+from PIL import Image, ImageDraw
+
+from app.ImagePipeline import make_thumbnail, open_image, recompress
+
+CANVAS_SIZE = (800, 600)
+COLOURS = ['black', 'red', 'blue', 'green', 'orange', 'purple']
+
+
+def draw(random_source, strokes, anti_aliased):
+    scale = 2 if anti_aliased else 1
+    canvas = Image.new('RGBA', (CANVAS_SIZE[0] * scale, CANVAS_SIZE[1] * scale), 'white')
+    pen = ImageDraw.Draw(canvas)
+    for _ in range(strokes):
+        x, y = random_source.randrange(canvas.width), random_source.randrange(canvas.height)
+        points = [(x, y)]
+        for _ in range(random_source.randrange(5, 30)):
+            x = min(max(x + random_source.randint(-40, 40) * scale, 0), canvas.width)
+            y = min(max(y + random_source.randint(-40, 40) * scale, 0), canvas.height)
+            points.append((x, y))
+        pen.line(points, fill=random_source.choice(COLOURS), width=random_source.randint(2, 8) * scale, joint='curve')
+    if anti_aliased:
+        canvas = canvas.resize(CANVAS_SIZE, Image.LANCZOS)
+    export = io.BytesIO()
+    canvas.save(export, 'PNG')
+    return export.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--drawings', type=int, default=20)
+    parser.add_argument('--strokes', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    random_source = random.Random(args.seed)
+    totals = {}
+    for number in range(args.drawings):
+        kind = 'anti-aliased' if number % 2 else 'hard-edged'
+        data = draw(random_source, args.strokes, anti_aliased=number % 2 == 1)
+        image = open_image(data)
+        sizes = [len(data), min(len(data), len(recompress(image))),
+                 len(make_thumbnail(image, 200, 'webp')), len(make_thumbnail(image, 200, 'png'))]
+        totals[kind] = [total + size for total, size in zip(totals.get(kind, [0] * 5), [1] + sizes)]
+    print('{:>13} {:>7} {:>12} {:>12} {:>15} {:>14}'.format(
+        'drawings', 'count', 'posted', 'stored', 'webp thumbnail', 'png thumbnail'))
+    for kind, (count, posted, stored, webp, png) in sorted(totals.items()):
+        print('{:>13} {:>7} {:>10.1f}KB {:>10.1f}KB {:>13.1f}KB {:>12.1f}KB   ({:.0%} of posted)'.format(
+            kind, count, posted / count / 1024, stored / count / 1024, webp / count / 1024, png / count / 1024,
+            stored / posted))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Measures how many bytes the database hands back for one client poll.
+
+A poll is what every browser tab does every two seconds: GET the game summary and GET its own status.
+The game is played through the API up to the last round of a 10-player game, so every earlier image
+is already stored, and then one poll per player is measured against SQLite.
+
+Run from the api directory:  python -m tests.bench_poll_bytes [--players 10] [--image-kb 512]
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+
+from app import create_app, db
+
+
+class ByteCountingCursor(sqlite3.Cursor):
+    bytes_read = 0
+    lock = threading.Lock()
+
+    def _count(self, rows):
+        counted = sum(len(value) if isinstance(value, (str, bytes)) else 8 for row in rows for value in row)
+        with ByteCountingCursor.lock:
+            ByteCountingCursor.bytes_read += counted
+        return rows
+
+    def fetchone(self):
+        row = super().fetchone()
+        return row if row is None else self._count([row])[0]
+
+    def fetchmany(self, *args, **kwargs):
+        return self._count(super().fetchmany(*args, **kwargs))
+
+    def fetchall(self):
+        return self._count(super().fetchall())
+
+
+class ByteCountingConnection(sqlite3.Connection):
+    def cursor(self, factory=ByteCountingCursor):
+        return super().cursor(factory)
+
+
+def play_until_last_round(client, game, players, image):
+    for player in players:
+        client.post('/join', json={'username': player, 'game': game})
+    for round_number in range(1, len(players)):
+        for player in players:
+            if round_number % 2 == 1:
+                client.post('/phrase', json={'username': player, 'game': game, 'phrase': 'phrase ' + player})
+            else:
+                client.post('/image', json={'username': player, 'game': game, 'image': image})
+
+
+def measure_polls(client, game, players):
+    ByteCountingCursor.bytes_read = 0
+    for player in players:
+        client.get('/game/' + game)
+        client.get('/game/' + game + '/player/' + player)
+    return ByteCountingCursor.bytes_read / len(players)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=10)
+    parser.add_argument('--image-kb', type=int, default=512)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(directory, 'bench.db'),
+            'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'factory': ByteCountingConnection}},
+        })
+        with app.app_context():
+            db.create_all()
+            client = app.test_client()
+            players = ['player' + str(i) for i in range(args.players)]
+            image = 'data:image/png;base64,' + 'A' * (args.image_kb * 1024)
+            play_until_last_round(client, 'bench', players, image)
+            bytes_per_poll = measure_polls(client, 'bench', players)
+            print('{} players, {} KB images: {:,.0f} bytes read from the database per poll'.format(
+                args.players, args.image_kb, bytes_per_poll))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Load-tests the polling endpoints under gunicorn at several worker counts.
+
+A 10-player game in its image round is written to a SQLite file (or the database in DATABASE_URL), then
+for each worker count gunicorn serves it with the production profile (gunicorn.conf.py, whose Uvicorn
+workers serve the ASGI entry point) while client threads alternate GET /game/<code> and
+GET /game/<code>/player/<name> over keep-alive connections for a fixed time.
+
+Run from the api directory:  python -m tests.bench_polling_workers [--workers 1 4 8] [--clients 32] [--seconds 10]
+"""
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from app import create_app, db
+
+GAME = 'bench'
+PLAYERS = ['player' + str(i) for i in range(10)]
+
+
+def seed(database_uri):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_uri})
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        for player in PLAYERS:
+            client.post('/join', json={'username': player, 'game': GAME})
+        for player in PLAYERS:
+            client.post('/phrase', json={'username': player, 'game': GAME, 'phrase': 'phrase ' + player})
+        client.post('/image', json={'username': PLAYERS[0], 'game': GAME, 'image': 'data:image/png;base64,iVBORw0KGgo='})
+
+
+def wait_for_server(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start on port ' + str(port))
+
+
+def poll(port, client_number, stop, counts):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    player = PLAYERS[client_number % len(PLAYERS)]
+    paths = ['/game/' + GAME, '/game/' + GAME + '/player/' + player]
+    requests = 0
+    while not stop.is_set():
+        connection.request('GET', paths[requests % 2])
+        response = connection.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError('unexpected status ' + str(response.status))
+        requests += 1
+    counts[client_number] = requests
+
+
+def measure(port, workers, clients, seconds, environment):
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--workers', str(workers),
+                               '--bind', '127.0.0.1:' + str(port), 'asgi:app'], env=environment,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_server(port)
+        stop = threading.Event()
+        counts = [0] * clients
+        threads = [threading.Thread(target=poll, args=(port, n, stop, counts)) for n in range(clients)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return sum(counts) / seconds
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--port', type=int, default=18080)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_uri = os.environ.get('DATABASE_URL', 'sqlite:///' + os.path.join(directory, 'bench.db'))
+        seed(database_uri)
+        environment = dict(os.environ, DATABASE_URL=database_uri)
+        for workers in args.workers:
+            requests_per_second = measure(args.port, workers, args.clients, args.seconds, environment)
+            print('{} worker(s), {} clients: {:,.0f} requests/s'.format(workers, args.clients, requests_per_second))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Times results generation for finished games of increasing size.
+
+Each game is written straight into an in-memory SQLite database (every player submits once per round,
+alternating phrases and images), then a freshly loaded Game builds every submission thread.
+
+Run from the api directory:  python -m tests.bench_results [--players 4 16 64 256] [--repeat 3]
+"""
+import argparse
+import time
+from datetime import datetime
+
+from app import create_app, db, get_game_by_code
+from app.Game import Game
+from app.ImageSubmission import ImageSubmission
+from app.PhraseSubmission import PhraseSubmission
+from app.Player import Player
+
+
+def create_finished_game(code, number_of_players):
+    game = Game(code)
+    db.session.add(game)
+    db.session.flush()
+    now = datetime.now()
+    db.session.bulk_insert_mappings(Player, [
+        {'name': 'player' + str(seat), 'status': 'GAME_OVER', 'time_joined': now, 'game_id': game.id, 'seat': seat}
+        for seat in range(number_of_players)])
+    player_ids = [player_id for (player_id,) in
+                  db.session.query(Player.id).filter_by(game_id=game.id).order_by(Player.id)]
+    phrases, images = [], []
+    for round_number in range(number_of_players):
+        for player_id in player_ids:
+            submission = {'time': now, 'game_id': game.id, 'player_id': player_id}
+            if round_number % 2 == 0:
+                phrases.append(dict(submission, phrase='phrase {} {}'.format(player_id, round_number)))
+            else:
+                images.append(dict(submission, image_id='{:064x}.png'.format(player_id * 1000 + round_number)))
+    db.session.bulk_insert_mappings(PhraseSubmission, phrases)
+    db.session.bulk_insert_mappings(ImageSubmission, images)
+    db.session.commit()
+
+
+def time_results(code, repeat):
+    timings = []
+    for _ in range(repeat):
+        db.session.remove()
+        start = time.perf_counter()
+        threads = get_game_by_code(code).get_all_submission_threads_indexed_by_user()
+        timings.append(time.perf_counter() - start)
+    return min(timings), threads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, nargs='+', default=[4, 16, 64, 256])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+    with app.test_request_context():
+        db.create_all()
+        for number_of_players in args.players:
+            code = 'bench-' + str(number_of_players)
+            create_finished_game(code, number_of_players)
+            seconds, threads = time_results(code, args.repeat)
+            assert len(threads) == number_of_players and len(threads[-1]['submissions']) == number_of_players
+            print('{:>4} players, {:>6} submissions: {:9.3f} ms'.format(
+                number_of_players, number_of_players ** 2, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
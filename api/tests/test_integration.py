@@ -1,7 +1,36 @@
+import asyncio
+import base64
+import gzip
+from datetime import datetime, timedelta
+import fcntl
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
+from urllib.parse import urlparse
 from flask import current_app
+from sqlalchemy import event, text
 
-from app import db
+from app import db, get_game_by_code, image_store, janitor, metrics, replicas, shards
+from app.ImageStore import image_id_for
+from app.ImageSubmission import ImageSubmission
+from app.PhraseSubmission import PhraseSubmission
+from app.Player import Player
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import a2wsgi
+    from app.EventStreams import EventStreamApp
+except ImportError:
+    EventStreamApp = None
 
 class IntegrationTests(unittest.TestCase):
     def setUp(self):
@@ -203,9 +232,20 @@ class IntegrationTests(unittest.TestCase):
         self.add_players_kirk_and_spock()
         self.add_phrases_for_kirk_and_spock()
         self.add_images_for_kirk_and_spock()
-        response = self.app.post('/join', json={'username': 'Mikey', 'game': 'NCC-1701'})
+        response = self.app.post('/join', json={'username': 'Kirk', 'game': 'NCC-1701'})
         self.assertEqual(response.status_code, 200)
 
+    def test_cannot_join_a_game_that_is_over_as_a_new_player(self):
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        self.add_images_for_kirk_and_spock()
+        response = self.app.post('/join', json={'username': 'Mikey', 'game': 'NCC-1701'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], "Cannot join a game that is over.")
+        self.assertEqual([player['username'] for player in self.app.get('/game/NCC-1701').get_json()['players']],
+                         ['Kirk', 'Spock'])
+        self.assertEqual(self.get_results().status_code, 200)
+
     def test_image_prompts_include_proper_phrase(self):
         self.add_players_kirk_bones_and_spock()
         self.add_phrases_for_kirk_bones_and_spock()
@@ -243,6 +283,17 @@ class IntegrationTests(unittest.TestCase):
         self.assertEqual(response.get_json()['error'],
                          "Cannot submit image: Missing username.")
 
+    def test_cannot_submit_without_the_submission(self):
+        self.add_players_kirk_and_spock()
+        response = self.app.post('/phrase', json={'username': 'Kirk', 'game': 'NCC-1701'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], "Cannot submit phrase: Missing phrase.")
+        self.add_phrases_for_kirk_and_spock()
+        response = self.app.post('/image', json={'username': 'Kirk', 'game': 'NCC-1701'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], "Cannot submit image: Missing image.")
+        self.assert_post_image_error("Kirk", 1701, "NCC-1701", "Cannot submit image: image must be a string.")
+
     def test_cannot_submit_phrase_without_game_name(self):
         self.add_players_kirk_and_spock()
         self.add_phrases_for_kirk_and_spock()
@@ -268,7 +319,17 @@ class IntegrationTests(unittest.TestCase):
         self.add_phrases_for_kirk_bones_and_spock()
         self.add_images_for_kirk_bones_and_spock()
 
-        self.assert_player_status("SUBMIT_PHRASE", "Kirk", prompt='bones image')
+        self.assert_player_status("SUBMIT_PHRASE", "Kirk")
+        self.assertEqual(self.get_image(self.app.get('/game/NCC-1701/player/Kirk').get_json()['prompt']), 'bones image')
+
+    def test_cached_image_prompts_point_at_the_host_each_client_connected_to(self):
+        self.add_players_kirk_bones_and_spock()
+        self.add_phrases_for_kirk_bones_and_spock()
+        self.add_images_for_kirk_bones_and_spock()
+        prompt = self.app.get('/game/NCC-1701/player/Kirk').get_json()['prompt']
+        self.assertTrue(prompt.startswith('http://localhost/image/'))
+        response = self.app.get('/game/NCC-1701/player/Kirk', base_url='https://teledraw.example')
+        self.assertEqual(response.get_json()['prompt'], 'https://teledraw.example' + urlparse(prompt).path)
 
     def test_status_is_game_over_for_everyone_after_one_submission_per_player(self):
         self.add_players_kirk_and_spock()
@@ -302,11 +363,11 @@ class IntegrationTests(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.get_json()[0]['originator'], "Kirk")
         self.assertEqual(response.get_json()[0]['submissions'][0], "Ever dance with the devil in the pale moonlight?")
-        self.assertEqual(response.get_json()[0]['submissions'][1], "spock image")
+        self.assertEqual(self.get_image(response.get_json()[0]['submissions'][1]), "spock image")
 
         self.assertEqual(response.get_json()[1]['originator'], "Spock")
         self.assertEqual(response.get_json()[1]['submissions'][0], "The devil went down to Georgia.")
-        self.assertEqual(response.get_json()[1]['submissions'][1], "kirk image")
+        self.assertEqual(self.get_image(response.get_json()[1]['submissions'][1]), "kirk image")
 
     def test_can_get_results_after_completed_three_player_game(self):
         self.add_players_kirk_bones_and_spock()
@@ -317,17 +378,17 @@ class IntegrationTests(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.get_json()[0]['originator'], "Kirk")
         self.assertEqual(response.get_json()[0]['submissions'][0], "Ever dance with the devil in the pale moonlight?")
-        self.assertEqual(response.get_json()[0]['submissions'][1], "spock image")
+        self.assertEqual(self.get_image(response.get_json()[0]['submissions'][1]), "spock image")
         self.assertEqual(response.get_json()[0]['submissions'][2], "Bones phrase 2")
 
         self.assertEqual(response.get_json()[1]['originator'], "Spock")
         self.assertEqual(response.get_json()[1]['submissions'][0], "The devil went down to Georgia.")
-        self.assertEqual(response.get_json()[1]['submissions'][1], "bones image")
+        self.assertEqual(self.get_image(response.get_json()[1]['submissions'][1]), "bones image")
         self.assertEqual(response.get_json()[1]['submissions'][2], "Kirk phrase 2")
 
         self.assertEqual(response.get_json()[2]['originator'], "Bones")
         self.assertEqual(response.get_json()[2]['submissions'][0], "That is devilishly clever.")
-        self.assertEqual(response.get_json()[2]['submissions'][1], "kirk image")
+        self.assertEqual(self.get_image(response.get_json()[2]['submissions'][1]), "kirk image")
         self.assertEqual(response.get_json()[2]['submissions'][2], "Spock phrase 2")
 
     def test_can_get_results_after_a_completed_three_player_game_with_different_submission_order(self):
@@ -346,15 +407,15 @@ class IntegrationTests(unittest.TestCase):
         self.assertEqual(response.get_json()[0]['originator'], "Kirk")
         self.assertEqual(response.get_json()[0]['submissions'][0],
                          "Ever dance with the devil in the pale moonlight?")
-        self.assertEqual(response.get_json()[0]['submissions'][1], "spock image")
+        self.assertEqual(self.get_image(response.get_json()[0]['submissions'][1]), "spock image")
         self.assertEqual(response.get_json()[0]['submissions'][2], "Bones phrase 2")
         self.assertEqual(response.get_json()[1]['originator'], "Spock")
         self.assertEqual(response.get_json()[1]['submissions'][0], "The devil went down to Georgia.")
-        self.assertEqual(response.get_json()[1]['submissions'][1], "bones image")
+        self.assertEqual(self.get_image(response.get_json()[1]['submissions'][1]), "bones image")
         self.assertEqual(response.get_json()[1]['submissions'][2], "Kirk phrase 2")
         self.assertEqual(response.get_json()[2]['originator'], "Bones")
         self.assertEqual(response.get_json()[2]['submissions'][0], "That is devilishly clever.")
-        self.assertEqual(response.get_json()[2]['submissions'][1], "kirk image")
+        self.assertEqual(self.get_image(response.get_json()[2]['submissions'][1]), "kirk image")
         self.assertEqual(response.get_json()[2]['submissions'][2], "Spock phrase 2")
 
     def test_three_player_game_in_which_phrases_are_correctly_guessed(self):
@@ -369,15 +430,15 @@ class IntegrationTests(unittest.TestCase):
         self.assertEqual(response.get_json()[0]['originator'], "Kirk")
         self.assertEqual(response.get_json()[0]['submissions'][0],
                          "Ever dance with the devil in the pale moonlight?")
-        self.assertEqual(response.get_json()[0]['submissions'][1], "spock image")
+        self.assertEqual(self.get_image(response.get_json()[0]['submissions'][1]), "spock image")
         self.assertEqual(response.get_json()[0]['submissions'][2], "Ever dance with the devil in the pale moonlight?")
         self.assertEqual(response.get_json()[1]['originator'], "Spock")
         self.assertEqual(response.get_json()[1]['submissions'][0], "The devil went down to Georgia.")
-        self.assertEqual(response.get_json()[1]['submissions'][1], "bones image")
+        self.assertEqual(self.get_image(response.get_json()[1]['submissions'][1]), "bones image")
         self.assertEqual(response.get_json()[1]['submissions'][2], "The devil went down to Georgia.")
         self.assertEqual(response.get_json()[2]['originator'], "Bones")
         self.assertEqual(response.get_json()[2]['submissions'][0], "That is devilishly clever.")
-        self.assertEqual(response.get_json()[2]['submissions'][1], "kirk image")
+        self.assertEqual(self.get_image(response.get_json()[2]['submissions'][1]), "kirk image")
         self.assertEqual(response.get_json()[2]['submissions'][2], "That is devilishly clever.")
 
     def test_can_conduct_two_games_at_once(self):
@@ -412,6 +473,848 @@ class IntegrationTests(unittest.TestCase):
         self.add_third_phrases_for_kirk_spock_bones_obrien_and_worf()
         self.assert_players_status(["Kirk", "Spock", "Bones", "Obrien", "Worf"], "GAME_OVER")
 
+    def test_event_stream_starts_with_summary_and_status(self):
+        self.add_players_kirk_and_spock()
+        response = self.app.get('/game/NCC-1701/events?username=Kirk', buffered=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        events = self.read_events(response)
+        self.assertEqual(events['summary']['players'][1]['username'], "Spock")
+        self.assertEqual(events['status']['description'], "SUBMIT_INITIAL_PHRASE")
+        response.close()
+
+    def test_event_stream_pushes_new_status_when_round_advances(self):
+        self.add_players_kirk_and_spock()
+        response = self.app.get('/game/NCC-1701/events?username=Kirk', buffered=False)
+        self.read_events(response)
+        self.add_phrases_for_kirk_and_spock()
+        events = self.read_events(response)
+        self.assertEqual(events['status']['description'], "SUBMIT_IMAGE")
+        self.assertEqual(events['status']['prompt'], "The devil went down to Georgia.")
+        self.assertEqual(events['summary']['phaseNumber'], 2)
+        response.close()
+
+    @unittest.skipUnless(EventStreamApp, 'a2wsgi is not installed')
+    def test_asgi_event_stream_pushes_new_status_when_round_advances(self):
+        self.add_players_kirk_and_spock()
+        self.post_phrase('Kirk', 'Ever dance with the devil in the pale moonlight?')
+        sent = self.stream_asgi_events('/game/NCC-1701/events', b'username=Kirk', chunks=2,
+                                       after_first_chunk=lambda: self.post_phrase('Spock', 'The devil went down to Georgia.'))
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream; charset=utf-8'), sent[0]['headers'])
+        self.assertEqual(self.parse_events(sent[1]['body'])['status']['description'], "WAIT")
+        events = self.parse_events(sent[2]['body'])
+        self.assertEqual(events['status']['description'], "SUBMIT_IMAGE")
+        self.assertEqual(events['status']['prompt'], "The devil went down to Georgia.")
+
+    @unittest.skipUnless(EventStreamApp, 'a2wsgi is not installed')
+    def test_asgi_event_stream_warns_of_invalid_game_name(self):
+        sent = self.stream_asgi_events('/game/NCC-1701C/events', b'username=Kirk')
+        self.assertEqual(sent[0]['status'], 400)
+        self.assertEqual(json.loads(sent[1]['body'])['error'], 'No such game: "NCC-1701C".')
+
+    def test_long_poll_returns_as_soon_as_the_players_status_changes(self):
+        self.add_players_kirk_and_spock()
+        self.post_phrase('Kirk', 'Ever dance with the devil in the pale moonlight?')
+        version = self.app.get('/game/NCC-1701/player/Kirk').headers['X-Game-Version']
+        self.after(0.2, lambda: self.post_phrase('Spock', 'The devil went down to Georgia.'))
+        started = time.monotonic()
+        response = self.app.get('/game/NCC-1701/player/Kirk?since=' + version + '&wait=10')
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(response.get_json()['description'], "SUBMIT_IMAGE")
+        self.assertGreater(int(response.headers['X-Game-Version']), int(version))
+
+    def test_long_poll_answers_at_once_when_the_client_is_behind(self):
+        self.add_players_kirk_and_spock()
+        started = time.monotonic()
+        response = self.app.get('/game/NCC-1701/player/Kirk?since=0&wait=10')
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(response.get_json()['description'], "SUBMIT_INITIAL_PHRASE")
+
+    def test_long_poll_times_out_with_the_unchanged_status(self):
+        self.add_players_kirk_and_spock()
+        response = self.app.get('/game/NCC-1701/player/Kirk')
+        started = time.monotonic()
+        response = self.app.get('/game/NCC-1701/player/Kirk?since=' + response.headers['X-Game-Version'] + '&wait=1',
+                                headers={'If-None-Match': response.headers['ETag']})
+        self.assertGreaterEqual(time.monotonic() - started, 1)
+        self.assertEqual(response.status_code, 304)
+
+    def test_cannot_long_poll_with_a_negative_wait(self):
+        self.add_players_kirk_and_spock()
+        self.assert_status_error('Cannot get player status: since and wait must be non-negative integers.',
+                                 'Kirk?wait=-1', 'NCC-1701')
+
+    @unittest.skipUnless(EventStreamApp, 'a2wsgi is not installed')
+    def test_asgi_long_poll_returns_as_soon_as_the_players_status_changes(self):
+        self.add_players_kirk_and_spock()
+        self.post_phrase('Kirk', 'Ever dance with the devil in the pale moonlight?')
+        version = self.app.get('/game/NCC-1701/player/Kirk').headers['X-Game-Version']
+        sent = self.request_asgi('/game/NCC-1701/player/Kirk', ('since=' + version + '&wait=10').encode(),
+                                 meanwhile=lambda: self.post_phrase('Spock', 'The devil went down to Georgia.'))
+        self.assertEqual(sent[0]['status'], 200)
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        self.assertEqual(json.loads(body)['description'], "SUBMIT_IMAGE")
+
+    def test_summaries_of_many_games_match_their_single_summaries(self):
+        self.add_players_kirk_bones_and_spock()
+        self.add_phrases_for_kirk_bones_and_spock()
+        self.add_players_obrien_and_worf()
+        response = self.app.post('/games/summary', json={'games': ['NCC-1701', 'NCC-1701D', 'NCC-1701C']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'NCC-1701': self.app.get('/game/NCC-1701').get_json(),
+                                               'NCC-1701D': self.app.get('/game/NCC-1701D').get_json(),
+                                               'NCC-1701C': None})
+
+    def test_summaries_take_the_same_queries_for_one_game_or_many(self):
+        for game in ['NCC-1701', 'NCC-1701A', 'NCC-1701B', 'NCC-1701D']:
+            self.add_players_obrien_and_worf(game=game)
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            self.app.post('/games/summary', json={'games': ['NCC-1701']})
+            one_game = len(statements)
+            self.app.post('/games/summary', json={'games': ['NCC-1701', 'NCC-1701A', 'NCC-1701B', 'NCC-1701D']})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(one_game, 2)
+        self.assertEqual(len(statements), 2 * one_game)
+
+    def test_cannot_get_summaries_without_a_list_of_games(self):
+        response = self.app.post('/games/summary', json={'games': 'NCC-1701'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], 'Cannot get summaries: games must be a list of game codes.')
+
+    def test_cannot_get_summaries_of_a_bare_list_of_games(self):
+        response = self.app.post('/games/summary', json=['NCC-1701'])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], 'Cannot get summaries: games must be a list of game codes.')
+
+    def test_loading_a_game_finds_its_players_by_index(self):
+        self.add_players_kirk_bones_and_spock()
+        plans = self.query_plans(lambda: self.app.get('/game/NCC-1701/player/Kirk'), 'FROM game')
+        self.assertTrue(plans)
+        for plan in plans:
+            self.assertIn('ix_player_game_id_seat', plan)
+
+    def test_prompts_find_the_latest_submission_by_index(self):
+        self.add_players_kirk_bones_and_spock()
+        self.add_phrases_for_kirk_bones_and_spock()
+        self.add_images_for_kirk_bones_and_spock()
+        plans = self.query_plans(lambda: self.app.get('/game/NCC-1701/player/Kirk'), 'FROM image_submission')
+        self.assertTrue(plans)
+        for plan in plans:
+            self.assertIn('ix_image_submission_game_id_player_id_id', plan)
+
+    def test_results_find_submissions_by_index(self):
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        self.add_images_for_kirk_and_spock()
+        plans = self.query_plans(lambda: self.get_results(), 'FROM phrase_submission', 'FROM image_submission')
+        self.assertEqual(len(plans), 2)
+        self.assertIn('ix_phrase_submission_game_id_player_id_id', plans[0])
+        self.assertIn('ix_image_submission_game_id_player_id_id', plans[1])
+
+    def test_can_delete_one_game_without_touching_others(self):
+        self.add_players_kirk_and_spock()
+        self.add_players_obrien_and_worf()
+        self.add_phrases_for_obrien_and_worf()
+        response = self.app.delete('/game/NCC-1701D')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.app.get('/game/NCC-1701D').get_json()['error'], 'No such game: "NCC-1701D".')
+        self.assert_player_status("SUBMIT_INITIAL_PHRASE", "Kirk")
+        self.assertEqual(self.app.delete('/game/NCC-1701D').get_json()['error'], 'No such game: "NCC-1701D".')
+
+    def test_deleting_a_game_keeps_images_another_game_still_uses(self):
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        self.add_players_obrien_and_worf()
+        self.add_phrases_for_obrien_and_worf()
+        self.post_image('Kirk', 'data:image/png;base64,iVBORw0KGgo=')
+        self.post_image('Obrien', 'data:image/png;base64,iVBORw0KGgo=', game='NCC-1701D')
+        image_path = '/image/' + image_id_for(b'\x89PNG\r\n\x1a\n', 'image/png')
+        self.app.delete('/game/NCC-1701')
+        self.assertEqual(self.app.get(image_path).status_code, 200)
+        self.app.delete('/game/NCC-1701D')
+        self.assertEqual(self.app.get(image_path).status_code, 404)
+
+    def test_creating_the_app_starts_no_janitor(self):
+        # every worker creates one, and they would all sweep the same database
+        self.assertEqual(current_app.config['JANITOR_INTERVAL_SECONDS'], 600)
+        self.assertNotIn('game-janitor', [thread.name for thread in threading.enumerate()])
+
+    def test_janitor_purges_only_expired_games(self):
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        self.add_images_for_kirk_and_spock()
+        self.add_players_obrien_and_worf()
+        self.app.post('/join', json={'username': 'Sisko', 'game': 'DS9'})
+        self.backdate('NCC-1701', hours=janitor.retention_hours + 1)
+        self.backdate('DS9', hours=janitor.abandoned_hours + 1)
+        self.assertEqual(janitor.purge(), 2)
+        self.assertEqual(self.app.get('/game/NCC-1701').status_code, 400)
+        self.assertEqual(self.app.get('/game/DS9').status_code, 400)
+        self.assertEqual(self.app.get('/game/NCC-1701D').status_code, 200)
+
+    def test_games_live_on_the_shard_their_code_hashes_to(self):
+        self.use_shards(2)
+        codes = ['NCC-' + str(number) for number in range(12)]
+        for code in codes:
+            self.add_players_kirk_and_spock(code)
+        sharded = next(code for code in codes if shards.shard_for(code) is not None)
+        for post, username, submission in [(self.post_phrase, 'Kirk', 'Kirk phrase'),
+                                           (self.post_phrase, 'Spock', 'Spock phrase'),
+                                           (self.post_image, 'Kirk', 'kirk image'),
+                                           (self.post_image, 'Spock', 'spock image')]:
+            self.assertEqual(post(username, submission, sharded).status_code, 200)
+        self.assertEqual(self.get_results(sharded).get_json()[0]['submissions'][0], 'Kirk phrase')
+        games_by_shard = {bind: {code for (code,) in db.get_engine(current_app, bind).execute(text('SELECT code FROM game'))}
+                          for bind in shards.binds}
+        self.assertEqual(games_by_shard, {bind: {code for code in codes if shards.shard_for(code) == bind}
+                                          for bind in shards.binds})
+        self.assertTrue(all(games_by_shard.values()))
+        summaries = self.app.post('/games/summary', json={'games': codes}).get_json()
+        self.assertEqual(summaries[sharded]['isOver'], True)
+        self.assertEqual([len(summaries[code]['players']) for code in codes], [2] * len(codes))
+
+    def test_can_delete_a_game_on_another_shard(self):
+        self.use_shards(2)
+        codes = ['NCC-' + str(number) for number in range(12)]
+        for code in codes:
+            self.add_players_kirk_and_spock(code)
+        sharded = next(code for code in codes if shards.shard_for(code) is not None)
+        # a fresh session, as a worker that has not just served this game would have
+        [response] = self.simultaneously([lambda: self.app.delete('/game/' + sharded)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.app.get('/game/' + sharded).get_json()['error'], 'No such game: "' + sharded + '".')
+        self.assertEqual([self.app.get('/game/' + code).status_code for code in codes if code != sharded],
+                         [200] * (len(codes) - 1))
+
+    def test_janitor_purges_expired_games_on_every_shard(self):
+        self.use_shards(2)
+        codes = ['NCC-' + str(number) for number in range(12)]
+        for code in codes:
+            self.add_players_kirk_and_spock(code)
+            self.backdate(code, hours=janitor.abandoned_hours + 1)
+        self.add_players_kirk_and_spock('DS9')
+        self.assertEqual(janitor.purge(), len(codes))
+        self.assertEqual(self.app.post('/games/summary', json={'games': codes + ['DS9']}).get_json(),
+                         dict({code: None for code in codes}, DS9=self.app.get('/game/DS9').get_json()))
+
+    def test_polls_read_from_a_lagging_replica_unless_the_client_has_seen_newer(self):
+        replicate = self.use_replica(lag_seconds=0)
+        self.add_players_kirk_and_spock()
+        replicate()
+        version = self.post_phrase('Kirk', 'Make it so.').headers['X-Game-Version']
+        self.assert_player_status("SUBMIT_INITIAL_PHRASE", "Kirk")
+        response = self.app.get('/game/NCC-1701/player/Kirk?since=' + version)
+        self.assertEqual(response.get_json()['description'], "WAIT")
+        self.assertEqual(response.headers['X-Game-Version'], version)
+        self.assertEqual(self.app.get('/game/NCC-1701?since=' + version).get_json()['players'][0]['status'],
+                         {'description': 'WAIT'})
+
+    def test_recently_changed_games_are_read_from_the_primary(self):
+        replicate = self.use_replica(lag_seconds=60)
+        self.add_players_kirk_and_spock()
+        replicate()
+        self.post_phrase('Kirk', 'Make it so.')
+        self.assert_player_status("WAIT", "Kirk")
+
+    def test_results_are_read_from_the_primary_when_the_replica_is_behind(self):
+        replicate = self.use_replica(lag_seconds=0)
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        self.post_image("Kirk", "kirk image")
+        replicate()
+        version = self.post_image("Spock", "spock image").headers['X-Game-Version']
+        self.assert_results_error("Cannot get results: game not over.")
+        response = self.app.get('/game/NCC-1701/results?since=' + version)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()[0]['submissions'][0], 'Ever dance with the devil in the pale moonlight?')
+
+    def test_cannot_read_since_a_negative_version(self):
+        self.add_players_kirk_and_spock()
+        self.assertEqual(self.app.get('/game/NCC-1701?since=-1').get_json()['error'],
+                         'Cannot get current summary: since must be a non-negative integer.')
+        self.assertEqual(self.app.get('/game/NCC-1701/results?since=-1').get_json()['error'],
+                         'Cannot get results: since must be a non-negative integer.')
+
+    def test_adding_a_shard_moves_only_the_games_that_hash_to_it(self):
+        self.addCleanup(shards.configure, current_app, [])
+        codes = ['game-' + str(number) for number in range(2000)]
+        shards.configure(current_app, ['sqlite://', 'sqlite://'])
+        before = {code: shards.shard_for(code) for code in codes}
+        shards.configure(current_app, ['sqlite://', 'sqlite://', 'sqlite://'])
+        moved = [code for code in codes if shards.shard_for(code) != before[code]]
+        self.assertEqual({shards.shard_for(code) for code in moved}, {'shard-3'})
+        self.assertLess(abs(len(moved) / len(codes) - 1 / 4), 0.1)
+
+    def test_janitor_keeps_unfinished_games_until_they_are_abandoned(self):
+        self.add_players_obrien_and_worf()
+        self.backdate('NCC-1701D', hours=janitor.retention_hours + 1)
+        self.assertEqual(janitor.purge(), 0)
+        self.assertEqual(self.app.get('/game/NCC-1701D').status_code, 200)
+
+    def test_event_stream_warns_of_invalid_game_name(self):
+        response = self.app.get('/game/NCC-1701C/events?username=Kirk')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], 'No such game: "NCC-1701C".')
+
+    def test_summary_is_not_modified_until_game_changes(self):
+        self.add_players_kirk_and_spock()
+        response = self.app.get('/game/NCC-1701')
+        etag = response.headers['ETag']
+        response = self.app.get('/game/NCC-1701', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.post_phrase('Kirk', 'Ever dance with the devil in the pale moonlight?')
+        response = self.app.get('/game/NCC-1701', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_status_is_not_modified_until_game_changes(self):
+        self.add_players_kirk_and_spock()
+        etag = self.app.get('/game/NCC-1701/player/Kirk').headers['ETag']
+        response = self.app.get('/game/NCC-1701/player/Kirk', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.add_phrases_for_kirk_and_spock()
+        response = self.app.get('/game/NCC-1701/player/Kirk', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['description'], "SUBMIT_IMAGE")
+
+    def test_results_are_not_modified_once_fetched(self):
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        self.add_images_for_kirk_and_spock()
+        etag = self.get_results().headers['ETag']
+        response = self.app.get('/game/NCC-1701/results', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_images_are_served_with_long_lived_cache_headers(self):
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        self.post_image("Kirk", "data:image/png;base64,iVBORw0KGgo=")
+        self.post_image("Spock", "spock image")
+        image_url = self.get_results().get_json()[1]['submissions'][1]
+        response = self.app.get(urlparse(image_url).path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertEqual(response.data, b'\x89PNG\r\n\x1a\n')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertTrue(response.headers['ETag'].startswith('W/'))
+        response = self.app.get(urlparse(image_url).path, headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    @unittest.skipUnless(Image, 'Pillow is not installed')
+    def test_submitted_images_are_recompressed_and_given_a_thumbnail(self):
+        drawing = Image.new('RGBA', (800, 600), 'white')
+        drawing.paste((0, 0, 0, 255), (100, 100, 700, 140))
+        canvas_export = io.BytesIO()
+        drawing.save(canvas_export, 'PNG', compress_level=1)
+        self.add_players_kirk_bones_and_spock()
+        self.add_phrases_for_kirk_bones_and_spock()
+        self.post_image("Kirk", "data:image/png;base64," + base64.b64encode(canvas_export.getvalue()).decode('ascii'))
+        self.post_image("Spock", "spock image")
+        self.post_image("Bones", "bones image")
+        image_store.pipeline.wait()
+        image_url = urlparse(self.app.get('/game/NCC-1701/player/Spock').get_json()['prompt']).path
+        stored = self.app.get(image_url)
+        self.assertLess(len(stored.data), len(canvas_export.getvalue()))
+        self.assertEqual(Image.open(io.BytesIO(stored.data)).convert('RGBA').tobytes(), drawing.tobytes())
+        response = self.app.get(image_url + '?size=thumbnail')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertEqual(Image.open(io.BytesIO(response.data)).size, (200, 150))
+
+    def test_thumbnail_falls_back_to_the_full_image_until_it_exists(self):
+        self.add_players_kirk_bones_and_spock()
+        self.add_phrases_for_kirk_bones_and_spock()
+        self.add_images_for_kirk_bones_and_spock()
+        image_url = urlparse(self.app.get('/game/NCC-1701/player/Spock').get_json()['prompt']).path
+        response = self.app.get(image_url + '?size=thumbnail')
+        self.assertEqual(response.status_code, 307)
+        self.assertEqual(urlparse(response.headers['Location']).path, image_url)
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+
+    def test_a_retried_phrase_is_saved_once(self):
+        self.add_players_kirk_and_spock()
+        first = self.post_phrase("Kirk", "Make it so.", key='kirk-1')
+        self.assertEqual(first.status_code, 200)
+        version = self.app.get('/game/NCC-1701/player/Kirk').headers['X-Game-Version']
+        retry = self.post_phrase("Kirk", "Make it so.", key='kirk-1')
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.app.get('/game/NCC-1701/player/Kirk').headers['X-Game-Version'], version)
+        self.assertEqual(PhraseSubmission.query.filter_by(idempotency_key='kirk-1').count(), 1)
+        self.assert_post_phrase_error("Kirk", "Make it so.", "NCC-1701",
+                                      "Cannot submit phrase: it is not Kirk's turn to submit a phrase.")
+
+    def test_a_retried_image_is_not_decoded_or_stored_again(self):
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        self.assertEqual(self.post_image("Kirk", "kirk image", key='kirk-2').status_code, 200)
+        retry = self.post_image("Kirk", "data:text/html;base64,PGgxPmhpPC9oMT4=", key='kirk-2')
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(ImageSubmission.query.filter_by(idempotency_key='kirk-2').count(), 1)
+
+    def test_cannot_submit_with_an_overlong_idempotency_key(self):
+        self.add_players_kirk_and_spock()
+        response = self.post_phrase("Kirk", "Make it so.", key='k' * 65)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'],
+                         'Cannot submit phrase: Idempotency-Key is longer than 64 characters.')
+
+    def test_cannot_submit_for_a_player_not_in_the_game(self):
+        self.add_players_kirk_and_spock()
+        self.assert_post_phrase_error("Q", "Omnipotence.", "NCC-1701",
+                                      'Cannot submit phrase: no player "Q" in this game.')
+
+    def test_a_submission_loads_the_game_once_and_commits_once(self):
+        self.add_players_kirk_and_spock()
+        statements, commits = [], []
+        record = lambda conn, cursor, statement, *args: statements.append(statement)
+        count_commit = lambda conn: commits.append(conn)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        event.listen(db.engine, 'commit', count_commit)
+        try:
+            self.assertEqual(self.post_phrase("Kirk", "Make it so.").status_code, 200)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+            event.remove(db.engine, 'commit', count_commit)
+        self.assertEqual(len([statement for statement in statements if statement.startswith('SELECT')]), 1)
+        self.assertEqual(len(commits), 1)
+
+    def test_an_image_can_be_uploaded_in_chunks(self):
+        self.use_temporary_upload_directory()
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        drawing = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 40
+        upload = self.start_upload("Kirk")
+        self.assertEqual(upload.status_code, 201)
+        upload_id = upload.get_json()['upload']
+        self.assertEqual(urlparse(upload.headers['Location']).path, '/image/uploads/' + upload_id)
+        for offset in range(0, len(drawing), 4096):
+            response = self.put_chunk(upload_id, offset, drawing[offset:offset + 4096])
+            self.assertEqual(response.get_json()['offset'], min(offset + 4096, len(drawing)))
+        self.assertEqual(self.app.post('/image/uploads/' + upload_id + '/finalize').status_code, 200)
+        self.assert_player_status("WAIT", "Kirk")
+        self.post_image("Spock", "spock image")
+        image_url = urlparse(self.get_results().get_json()[1]['submissions'][1]).path
+        self.assertTrue(image_url.endswith('.png'))
+        self.assertEqual(self.app.get(image_url).data, drawing)
+
+    def test_an_interrupted_upload_resumes_from_the_offset_the_server_has(self):
+        self.use_temporary_upload_directory()
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        upload_id = self.start_upload("Kirk").get_json()['upload']
+        self.put_chunk(upload_id, 0, b'\x89PNG')
+        response = self.put_chunk(upload_id, 8, b'rest of it')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.get_json()['offset'], 4)
+        self.assertEqual(self.app.get('/image/uploads/' + upload_id).get_json()['offset'], 4)
+        self.assertEqual(self.put_chunk(upload_id, 4, b'\r\n\x1a\n').get_json()['offset'], 8)
+
+    def test_a_chunk_sent_while_another_is_written_is_refused(self):
+        self.use_temporary_upload_directory()
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        upload_id = self.start_upload("Kirk").get_json()['upload']
+        with image_store.uploads.open(upload_id) as part:
+            fcntl.flock(part.fileno(), fcntl.LOCK_EX)
+            response = self.put_chunk(upload_id, 0, b'\x89PNG')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.get_json()['error'],
+                         'Cannot upload image: another chunk of this upload is being written.')
+        self.assertEqual(self.put_chunk(upload_id, 0, b'\x89PNG').get_json()['offset'], 4)
+
+    def test_a_retried_finalize_saves_the_image_once(self):
+        self.use_temporary_upload_directory()
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        upload_id = self.start_upload("Kirk").get_json()['upload']
+        self.put_chunk(upload_id, 0, b'\x89PNG\r\n\x1a\n')
+        self.assertEqual(self.app.post('/image/uploads/' + upload_id + '/finalize').status_code, 200)
+        retry = self.app.post('/image/uploads/' + upload_id + '/finalize')
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(ImageSubmission.query.filter_by(idempotency_key=upload_id).count(), 1)
+        self.assertEqual(self.app.get('/image/uploads/' + upload_id).status_code, 404)
+
+    def test_cannot_upload_a_chunk_larger_than_the_limit(self):
+        self.use_temporary_upload_directory()
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        upload = self.start_upload("Kirk").get_json()
+        response = self.put_chunk(upload['upload'], 0, b'x' * (upload['maxChunkBytes'] + 1))
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.get_json()['error'],
+                         'Cannot upload image: chunk is larger than ' + str(upload['maxChunkBytes']) + ' bytes.')
+        self.assertEqual(self.app.get('/image/uploads/' + upload['upload']).get_json()['offset'], 0)
+
+    def test_cannot_finalize_an_empty_upload(self):
+        self.use_temporary_upload_directory()
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        upload_id = self.start_upload("Kirk").get_json()['upload']
+        response = self.app.post('/image/uploads/' + upload_id + '/finalize')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], 'Cannot submit image: upload is empty.')
+
+    def test_cannot_start_an_upload_when_it_is_phrase_time(self):
+        self.use_temporary_upload_directory()
+        self.add_players_kirk_and_spock()
+        response = self.start_upload("Kirk")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'],
+                         "Cannot submit image: it is not Kirk's turn to submit an image.")
+
+    def test_cannot_start_an_upload_of_a_content_type_that_is_not_a_string(self):
+        self.use_temporary_upload_directory()
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        response = self.app.post('/image/uploads', json={'username': 'Kirk', 'game': 'NCC-1701', 'contentType': 42})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], 'Cannot start image upload: contentType must be a string.')
+
+    def test_cannot_start_an_upload_without_a_json_object(self):
+        response = self.app.post('/image/uploads', json=['Kirk', 'NCC-1701'])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], 'Cannot start image upload: Missing username.')
+
+    def test_janitor_removes_abandoned_uploads(self):
+        self.use_temporary_upload_directory()
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        upload_id = self.start_upload("Kirk").get_json()['upload']
+        self.assertEqual(image_store.uploads.purge(), 0)
+        self.assertEqual(image_store.uploads.purge(now=time.time() + 25 * 60 * 60), 1)
+        self.assertEqual(self.app.get('/image/uploads/' + upload_id).status_code, 404)
+
+    def test_cannot_submit_an_image_that_is_not_an_image(self):
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        self.assert_post_image_error("Kirk", "data:text/html;base64,PGgxPmhpPC9oMT4=", "NCC-1701",
+                                     'Cannot submit image: "text/html" is not an image type.')
+
+    def test_unknown_image_is_not_found(self):
+        response = self.app.get('/image/' + '0' * 64 + '.png')
+        self.assertEqual(response.status_code, 404)
+
+    def test_results_can_be_fetched_one_thread_at_a_time(self):
+        self.add_players_kirk_bones_and_spock()
+        self.add_phrases_for_kirk_bones_and_spock()
+        self.add_images_for_kirk_bones_and_spock()
+        self.add_second_phrases_for_kirk_bones_and_spock()
+        response = self.app.get('/game/NCC-1701/results?originator=Spock')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()), 1)
+        self.assertEqual(response.get_json()[0]['originator'], "Spock")
+        self.assertEqual(response.get_json()[0]['submissions'][2], "Kirk phrase 2")
+
+    def test_results_can_be_paginated(self):
+        self.add_players_kirk_bones_and_spock()
+        self.add_phrases_for_kirk_bones_and_spock()
+        self.add_images_for_kirk_bones_and_spock()
+        self.add_second_phrases_for_kirk_bones_and_spock()
+        response = self.app.get('/game/NCC-1701/results?offset=1&limit=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Total-Count'], '3')
+        self.assertEqual([thread['originator'] for thread in response.get_json()], ["Spock"])
+        response = self.app.get('/game/NCC-1701/results?offset=2&limit=5')
+        self.assertEqual([thread['originator'] for thread in response.get_json()], ["Bones"])
+
+    def test_results_can_be_streamed(self):
+        self.add_players_kirk_bones_and_spock()
+        self.add_phrases_for_kirk_bones_and_spock()
+        self.add_images_for_kirk_bones_and_spock()
+        self.add_second_phrases_for_kirk_bones_and_spock()
+        streamed = self.app.get('/game/NCC-1701/results?stream=true')
+        self.assertEqual(streamed.status_code, 200)
+        self.assertEqual(json.loads(streamed.data), self.get_results().get_json())
+
+    def test_compact_results_list_each_submission_once_and_thread_them_by_id(self):
+        self.add_players_kirk_bones_and_spock()
+        self.add_phrases_for_kirk_bones_and_spock()
+        self.add_images_for_kirk_bones_and_spock()
+        self.add_second_phrases_for_kirk_bones_and_spock()
+        response = self.app.get('/game/NCC-1701/results?format=compact')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Total-Count'], '3')
+        compact = response.get_json()
+        self.assertEqual([submission[0] for submission in compact['submissions']], list(range(9)))
+        self.assertEqual(compact['players'], ["Kirk", "Spock", "Bones"])
+        self.assertEqual(compact['submissions'][1][1:3], [1, "image"])
+        submissions = {id: (type, ref) for id, author, type, ref in compact['submissions']}
+        expanded = [{'originator': thread['originator'],
+                     'submissions': [ref if type == 'phrase' else '/image/' + ref
+                                     for type, ref in map(submissions.get, thread['submissions'])]}
+                    for thread in compact['threads']]
+        threads = self.get_results().get_json()
+        for thread in threads:
+            thread['submissions'][1] = urlparse(thread['submissions'][1]).path
+        self.assertEqual(expanded, threads)
+
+    def test_compact_results_are_gzipped_when_accepted(self):
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        self.add_images_for_kirk_and_spock()
+        plain = self.app.get('/game/NCC-1701/results?format=compact', headers={'Accept-Encoding': 'identity'})
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+        response = self.app.get('/game/NCC-1701/results?format=compact', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.data)), plain.get_json())
+        self.assertNotEqual(response.headers['ETag'], plain.headers['ETag'])
+        response = self.app.get('/game/NCC-1701/results?format=compact',
+                                headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_large_json_responses_are_compressed_when_accepted(self):
+        games = {'games': ['NCC-' + str(number) for number in range(200)]}
+        plain = self.app.post('/games/summary', json=games)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertGreater(len(plain.data), 1024)
+        response = self.app.post('/games/summary', json=games, headers={'Accept-Encoding': 'br;q=0, gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertLess(len(response.data), len(plain.data))
+        self.assertEqual(json.loads(gzip.decompress(response.data)), plain.get_json())
+
+    def test_small_responses_are_not_compressed(self):
+        self.add_players_kirk_and_spock()
+        response = self.app.get('/game/NCC-1701', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+
+    def test_finished_results_are_rendered_and_compressed_once(self):
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        self.add_images_for_kirk_and_spock()
+        first = self.app.get('/game/NCC-1701/results', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(first.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(first.data)), self.get_results().get_json())
+        statements = []
+        record = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            again = self.app.get('/game/NCC-1701/results', headers={'Accept-Encoding': 'gzip'})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(again.data, first.data)
+        self.assertEqual([statement for statement in statements if '_submission' in statement.split('FROM')[-1]], [])
+
+    def test_cached_results_are_dropped_with_their_game(self):
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        self.add_images_for_kirk_and_spock()
+        self.get_results()
+        self.assertEqual(self.app.delete('/game/NCC-1701').status_code, 200)
+        self.add_players_kirk_and_spock()
+        self.post_phrase("Kirk", "Make it so.")
+        self.post_phrase("Spock", "Fascinating.")
+        self.add_images_for_kirk_and_spock()
+        self.assertEqual(self.get_results().get_json()[0]['submissions'][0], "Make it so.")
+
+    def test_cannot_get_results_in_an_unknown_format(self):
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        self.add_images_for_kirk_and_spock()
+        response = self.app.get('/game/NCC-1701/results?format=xml')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], 'Cannot get results: format must be "threads" or "compact".')
+
+    def test_cannot_get_results_for_a_player_not_in_the_game(self):
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        self.add_images_for_kirk_and_spock()
+        response = self.app.get('/game/NCC-1701/results?originator=Q')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], 'Cannot get results: no player "Q" in this game.')
+
+    def test_cannot_get_results_with_a_negative_offset(self):
+        self.add_players_kirk_and_spock()
+        self.add_phrases_for_kirk_and_spock()
+        self.add_images_for_kirk_and_spock()
+        response = self.app.get('/game/NCC-1701/results?offset=-1')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'],
+                         'Cannot get results: offset and limit must be non-negative integers.')
+
+    def test_round_advances_with_a_single_player_status_update(self):
+        self.add_players_kirk_bones_and_spock()
+        self.add_players_obrien_and_worf(game='NCC-1701')
+        self.post_phrase('Kirk', 'Ever dance with the devil in the pale moonlight?')
+        self.post_phrase('Spock', 'The devil went down to Georgia.')
+        self.post_phrase('Bones', 'That is devilishly clever.')
+        self.post_phrase('Obrien', 'Only Keiko calls me Miles')
+        player_updates = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('UPDATE player'):
+                player_updates.extend(parameters if executemany else [parameters])
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            self.post_phrase('Worf', 'A warrior\'s drink!')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        # Worf's own WAIT, then one statement moving the whole room on
+        self.assertEqual(len(player_updates), 2)
+        self.assert_players_status(["Kirk", "Spock", "Bones", "Obrien", "Worf"], "SUBMIT_IMAGE")
+
+    def test_stored_round_state_matches_state_derived_from_submissions(self):
+        self.add_players_kirk_bones_and_spock()
+        self.assert_stored_state_matches_derived_state()
+        for post, username, submission in [(self.post_phrase, 'Kirk', 'Kirk phrase'),
+                                           (self.post_phrase, 'Spock', 'Spock phrase'),
+                                           (self.post_phrase, 'Bones', 'Bones phrase'),
+                                           (self.post_image, 'Spock', 'spock image'),
+                                           (self.post_image, 'Kirk', 'kirk image'),
+                                           (self.post_image, 'Bones', 'bones image'),
+                                           (self.post_phrase, 'Bones', 'Bones phrase 2'),
+                                           (self.post_phrase, 'Kirk', 'Kirk phrase 2'),
+                                           (self.post_phrase, 'Spock', 'Spock phrase 2')]:
+            self.assertEqual(post(username, submission).status_code, 200)
+            self.assert_stored_state_matches_derived_state()
+        self.assertEqual(get_game_by_code('NCC-1701').get_stored_state(),
+                         {'state': 'GAME_OVER', 'phase': 4, 'phrase_count': 6, 'image_count': 3,
+                          'round_submission_count': 0})
+
+    def test_simultaneous_final_submissions_advance_each_round_exactly_once(self):
+        crew = ['Kirk', 'Spock', 'Bones', 'Uhura', 'Sulu', 'Chekov']
+        for username in crew:
+            self.app.post('/join', json={'username': username, 'game': 'NCC-1701'})
+        for phase in range(1, len(crew) + 1):
+            post = self.post_phrase if phase % 2 == 1 else self.post_image
+            responses = self.simultaneously([lambda username=username: post(username, username + ' ' + str(phase))
+                                             for username in crew])
+            self.assertEqual([response.status_code for response in responses], [200] * len(crew))
+            db.session.expire_all()
+            self.assert_stored_state_matches_derived_state()
+            self.assertEqual(get_game_by_code('NCC-1701').get_phase_number(), phase + 1)
+            expected = 'GAME_OVER' if phase == len(crew) else 'SUBMIT_IMAGE' if phase % 2 == 1 else 'SUBMIT_PHRASE'
+            for username in crew:
+                self.assert_player_status(expected, username)
+
+    def test_a_join_that_loses_a_race_to_the_first_phrase_is_refused(self):
+        self.add_players_kirk_and_spock()
+        raced = []
+
+        def submit_first_phrase_meanwhile(conn, cursor, statement, parameters, context, executemany):
+            # the join has checked the game but not yet written to it
+            if not raced and statement.startswith(('INSERT', 'UPDATE')):
+                raced.append(statement)
+                self.simultaneously([lambda: self.post_phrase('Kirk', 'Make it so.')])
+
+        event.listen(db.engine, 'before_cursor_execute', submit_first_phrase_meanwhile)
+        try:
+            response = self.app.post('/join', json={'username': 'Bones', 'game': 'NCC-1701'})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', submit_first_phrase_meanwhile)
+        self.assertTrue(raced)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], "Cannot join a game in progress.")
+        self.assertEqual([player['username'] for player in self.app.get('/game/NCC-1701').get_json()['players']],
+                         ['Kirk', 'Spock'])
+
+    def test_simultaneous_identical_images_are_all_saved(self):
+        games = ['NCC-' + str(number) for number in range(1701, 1707)]
+        for game in games:
+            self.add_players_kirk_and_spock(game)
+            self.post_phrase('Kirk', 'Make it so.', game)
+            self.post_phrase('Spock', 'Fascinating.', game)
+        decodes = []
+        decode = image_store.decode
+        self.addCleanup(setattr, image_store, 'decode', decode)
+        image_store.decode = lambda image, max_bytes: decodes.append(image) or decode(image, max_bytes)
+        responses = self.simultaneously([lambda username=username, game=game: self.post_image(username, 'tribble', game)
+                                         for game in games for username in ['Kirk', 'Spock']])
+        self.assertEqual([response.status_code for response in responses], [200] * 2 * len(games))
+        # once per post, though the posts conflicted and were retried
+        self.assertEqual(len(decodes), 2 * len(games))
+        for game in games:
+            self.assert_player_status('GAME_OVER', 'Kirk', game)
+
+    def test_joining_loads_the_game_once(self):
+        for username in ['Kirk', 'Spock']:
+            statements = []
+
+            def record(conn, cursor, statement, parameters, context, executemany):
+                if statement.startswith('SELECT') and 'FROM game' in statement:
+                    statements.append(statement)
+
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                response = self.app.post('/join', json={'username': username, 'game': 'NCC-1701'})
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(statements), 1)
+
+    def test_repeated_polls_are_answered_without_querying_the_database(self):
+        self.add_players_kirk_and_spock()
+        self.app.get('/game/NCC-1701')
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            self.assertEqual(self.app.get('/game/NCC-1701').status_code, 200)
+            self.assert_player_status("SUBMIT_INITIAL_PHRASE", "Spock", player_before="Kirk", player_after="Kirk")
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(statements, [])
+
+    def test_cache_stats_count_hits_misses_and_invalidations(self):
+        self.add_players_kirk_and_spock()
+        before = self.app.get('/cache/stats').get_json()
+        self.app.get('/game/NCC-1701')
+        self.app.get('/game/NCC-1701/player/Kirk')
+        self.post_phrase('Kirk', 'Ever dance with the devil in the pale moonlight?')
+        response = self.app.get('/game/NCC-1701/player/Kirk')
+        self.assertEqual(response.get_json()['description'], "WAIT")
+        after = self.app.get('/cache/stats').get_json()
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['misses'] - before['misses'], 2)
+        self.assertGreaterEqual(after['invalidations'] - before['invalidations'], 1)
+
+    def test_metrics_are_not_served_unless_enabled(self):
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('METRICS_ENABLED', response.get_json()['error'])
+
+    def test_metrics_record_requests_queries_and_game_methods(self):
+        self.enable_metrics()
+        self.add_players_kirk_and_spock()
+        self.app.get('/game/NCC-1701/player/Kirk')
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        samples = dict(line.rsplit(' ', 1) for line in response.get_data(as_text=True).splitlines()
+                       if not line.startswith('#'))
+        self.assertGreaterEqual(
+            float(samples['teledraw_request_duration_seconds_count{endpoint="join_game",method="POST"}']), 2)
+        self.assertGreater(float(samples['teledraw_request_queries_sum{endpoint="join_game",method="POST"}']), 0)
+        self.assertGreater(float(samples['teledraw_request_query_bytes_total{endpoint="join_game",method="POST"}']), 0)
+        self.assertGreaterEqual(float(samples['teledraw_game_method_duration_seconds_count{method="join"}']), 2)
+        self.assertIn('teledraw_game_cache_hits_total', samples)
+
+    def test_metrics_log_requests_over_the_query_threshold(self):
+        self.add_players_kirk_and_spock()
+        self.enable_metrics(query_log_threshold=0)
+        with self.assertLogs(current_app.logger, 'WARNING') as logs:
+            self.app.get('/game/NCC-1701/player/Kirk')
+        self.assertIn('/game/NCC-1701/player/Kirk', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
     # endregion
 
     # region assertions
@@ -449,6 +1352,10 @@ class IntegrationTests(unittest.TestCase):
         self.assertEqual(response.status_code, status_code)
         self.assertEqual(response.get_json()['error'], error)
 
+    def assert_stored_state_matches_derived_state(self, game="NCC-1701"):
+        game = get_game_by_code(game)
+        self.assertEqual(game.get_stored_state(), game.compute_derived_state())
+
     def assert_status_error(self, error_message="", username="", game=""):
         url = ('/game/' + ((game + '/') if len(game) > 0 else "")) + ('player' + (('/' + username) if len(username) > 0 else ""))
         response = self.app.get(url)
@@ -458,6 +1365,13 @@ class IntegrationTests(unittest.TestCase):
     # endregion
 
     # region testutil
+    def enable_metrics(self, query_log_threshold=None):
+        self.addCleanup(setattr, metrics, 'enabled', metrics.enabled)
+        self.addCleanup(setattr, metrics, 'query_log_threshold', metrics.query_log_threshold)
+        metrics.enabled = True
+        if query_log_threshold is not None:
+            metrics.query_log_threshold = query_log_threshold
+
 
     def add_images_for_obrien_and_worf(self, game='NCC-1701D'):
         self.post_image("Worf", "worf image", game)
@@ -479,9 +1393,9 @@ class IntegrationTests(unittest.TestCase):
         self.app.post('/join', json={'username': 'Obrien', 'game': game})
         self.app.post('/join', json={'username': 'Worf', 'game': game})
 
-    def add_players_kirk_and_spock(self):
-        self.app.post('/join', json={'username': 'Kirk', 'game': 'NCC-1701'})
-        self.app.post('/join', json={'username': 'Spock', 'game': 'NCC-1701'})
+    def add_players_kirk_and_spock(self, game='NCC-1701'):
+        self.app.post('/join', json={'username': 'Kirk', 'game': game})
+        self.app.post('/join', json={'username': 'Spock', 'game': game})
 
     def add_players_kirk_bones_and_spock(self):
         self.add_players_kirk_and_spock()
@@ -520,11 +1434,197 @@ class IntegrationTests(unittest.TestCase):
         self.post_phrase('Obrien', 'Obrien phrase 3')
         self.post_phrase('Worf', 'Worf phrase 3')
 
-    def post_image(self, username="", image="", game="NCC-1701"):
-        return self.app.post('/image', json={'username': username, 'image': image, 'game': game})
-
-    def post_phrase(self, username="", phrase="", game="NCC-1701"):
-        return self.app.post('/phrase', json={'username': username, 'phrase': phrase, 'game': game})
+    def post_image(self, username="", image="", game="NCC-1701", key=None):
+        return self.app.post('/image', json={'username': username, 'image': image, 'game': game},
+                             headers={'Idempotency-Key': key} if key else {})
+
+    def start_upload(self, username, game="NCC-1701"):
+        return self.app.post('/image/uploads', json={'username': username, 'game': game})
+
+    def put_chunk(self, upload_id, offset, data):
+        return self.app.put('/image/uploads/' + upload_id + '?offset=' + str(offset), data=data,
+                            content_type='application/octet-stream')
+
+    def use_shards(self, count):
+        """Spreads games over the test database and count more in a temporary directory."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(shards.configure, current_app, [])
+        self.addCleanup(db.session.remove)
+        shards.configure(current_app, ['sqlite:///' + os.path.join(directory.name, 'shard' + str(number) + '.db')
+                                       for number in range(1, count + 1)])
+        shards.create_all(current_app)
+
+    def use_replica(self, lag_seconds):
+        """Reads the polling endpoints from a copy of the test database, and returns a function that brings
+        the copy up to date.  Until it is called again, the copy lags."""
+        directory = tempfile.TemporaryDirectory()
+        replica = os.path.join(directory.name, 'replica.db')
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(replicas.configure, current_app, [])
+        self.addCleanup(setattr, replicas, 'lag_seconds', replicas.lag_seconds)
+        self.addCleanup(db.session.remove)
+
+        def replicate():
+            db.session.commit()
+            primary, copy = sqlite3.connect(db.engine.url.database), sqlite3.connect(replica)
+            try:
+                primary.backup(copy)
+            finally:
+                primary.close()
+                copy.close()
+
+        replicate()
+        replicas.configure(current_app, ['sqlite:///' + replica])
+        replicas.lag_seconds = lag_seconds
+        return replicate
+
+    def use_temporary_upload_directory(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(setattr, image_store.uploads, 'directory', image_store.uploads.directory)
+        image_store.uploads.directory = directory.name
+
+    def post_phrase(self, username="", phrase="", game="NCC-1701", key=None):
+        return self.app.post('/phrase', json={'username': username, 'phrase': phrase, 'game': game},
+                             headers={'Idempotency-Key': key} if key else {})
+
+    def get_image(self, url):
+        return self.app.get(urlparse(url).path).data.decode('utf-8')
+
+    def read_events(self, response):
+        return self.parse_events(next(response.response))
+
+    def parse_events(self, body):
+        events = {}
+        for block in body.decode('utf-8').strip().split('\n\n'):
+            lines = dict(line.split(': ', 1) for line in block.split('\n'))
+            events[lines['event']] = json.loads(lines['data'])
+        return events
+
+    def query_plans(self, request, *sources):
+        """The database's EXPLAIN output for each SELECT that request() issues from any of the given sources."""
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('SELECT') and any(source in statement for source in sources):
+                statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            request()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        explain = 'EXPLAIN QUERY PLAN ' if db.engine.name == 'sqlite' else 'EXPLAIN '
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            plans = []
+            for statement, parameters in statements:
+                cursor.execute(explain + statement, parameters)
+                plans.append(' '.join(str(value) for row in cursor.fetchall() for value in row))
+            return plans
+        finally:
+            connection.close()
+
+    def backdate(self, game, hours):
+        """Makes every join and submission of a game look `hours` old."""
+        game_id = get_game_by_code(game).id
+        then = datetime.now() - timedelta(hours=hours)
+        Player.query.filter_by(game_id=game_id).update({Player.time_joined: then}, synchronize_session=False)
+        for model in [PhraseSubmission, ImageSubmission]:
+            model.query.filter_by(game_id=game_id).update({model.time: then}, synchronize_session=False)
+        db.session.commit()
+
+    def stream_asgi_events(self, path, query_string=b'', chunks=1, after_first_chunk=None):
+        """Drives the ASGI entry point's event stream until it has sent `chunks` bodies, then disconnects."""
+        async def stream():
+            sent = []
+            disconnect = asyncio.Event()
+
+            async def receive():
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                bodies = [message for message in sent if message['type'] == 'http.response.body']
+                if len(bodies) == 1 and after_first_chunk:
+                    after_first_chunk()
+                if len(bodies) >= chunks:
+                    disconnect.set()
+
+            await self.call_asgi(path, query_string, receive, send)
+            return sent
+
+        return self.run_on_new_loop(stream())
+
+    def request_asgi(self, path, query_string=b'', meanwhile=None):
+        """Sends one GET through the ASGI entry point, calling meanwhile() on the loop once it is under way."""
+        async def request():
+            sent = []
+            body = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+            async def receive():
+                if body:
+                    return body.pop()
+                await asyncio.Event().wait()
+
+            async def send(message):
+                sent.append(message)
+
+            if meanwhile:
+                asyncio.get_event_loop().call_later(0.2, meanwhile)
+            await self.call_asgi(path, query_string, receive, send)
+            return sent
+
+        return self.run_on_new_loop(request())
+
+    def call_asgi(self, path, query_string, receive, send):
+        scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'path': path, 'raw_path': path.encode(),
+                 'query_string': query_string, 'scheme': 'http', 'headers': [(b'host', b'localhost')],
+                 'server': ('localhost', 80), 'client': ('127.0.0.1', 50000), 'root_path': ''}
+        return asyncio.wait_for(EventStreamApp(current_app._get_current_object())(scope, receive, send), 10)
+
+    def run_on_new_loop(self, coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def simultaneously(self, actions):
+        """Runs each action on its own thread, as clients on different workers would, all released at once,
+        and returns what they returned."""
+        app = current_app._get_current_object()
+        start = threading.Barrier(len(actions))
+        results = [None] * len(actions)
+
+        def run(number, action):
+            with app.app_context():
+                start.wait()
+                results[number] = action()
+                db.session.remove()
+
+        threads = [threading.Thread(target=run, args=(number, action)) for number, action in enumerate(actions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def after(self, seconds, action):
+        """Runs action on another thread, as another client would, while the test waits on a request."""
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                action()
+                db.session.remove()
+
+        timer = threading.Timer(seconds, run)
+        timer.start()
+        self.addCleanup(timer.join)
 
     def get_results(self, game="NCC-1701"):
         if game:
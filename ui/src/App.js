@@ -1,4 +1,4 @@
-import React, {useState} from "react";
+import React, {useEffect, useRef, useState} from "react";
 import "./App.css";
 import {JoinForm} from "./statecomponents/JoinForm.js";
 import PhraseForm from "./statecomponents/PhraseForm.js";
@@ -9,19 +9,60 @@ import {useInterval} from "./hooks/interval";
 import IdentityPanel from "./helpercomponents/IdentityPanel";
 import AllPlayerStatusPanel from "./helpercomponents/AllPlayersStatusPanel";
 
+const SUBMIT_ATTEMPTS = 3;
+
 function App() {
     const [username, setUsername] = useState("");
     const [gameCode, setGameCode] = useState("");
     const [apiStatus, setApiStatus] = useState("");
     const [apiSummary, setApiSummary] = useState(undefined);
+    const [streaming, setStreaming] = useState(false);
+    // the newest game version this client has seen; polls pass it on so a lagging replica cannot take them back
+    const seenVersion = useRef(undefined);
+
+    useInterval(pollApiSummaryOnce, streaming ? null : 2000);
+
+    useEffect(() => {
+        if (username === "" || !window.EventSource) return;
+        const events = new EventSource(getUrl() + `/game/${gameCode}/events?username=${encodeURIComponent(username)}`);
+        events.onopen = () => setStreaming(true);
+        events.onerror = () => setStreaming(false);
+        events.addEventListener("status", (event) => setApiStatus(JSON.parse(event.data)));
+        events.addEventListener("summary", (event) => setApiSummary(JSON.parse(event.data)));
+        return () => {
+            events.close();
+            setStreaming(false);
+        };
+    }, [username, gameCode]);
+
+    useEffect(() => {
+        if (username === "" || streaming) return;
+        let stopped = false;
+
+        async function longPollApiStatus() {
+            let params = {};
+            while (!stopped) {
+                try {
+                    const status = await axios.get(getUrl() + `/game/${gameCode}/player/${username}`, {params});
+                    if (stopped) return;
+                    setApiStatus(sawVersion(status).data);
+                    params = {since: status.headers["x-game-version"], wait: 30};
+                } catch (error) {
+                    await new Promise((resolve) => setTimeout(resolve, 2000));
+                }
+            }
+        }
 
-    useInterval(pollApiStatusOnce, 2000);
-    useInterval(pollApiSummaryOnce, 2000);
+        longPollApiStatus();
+        return () => {
+            stopped = true;
+        };
+    }, [username, gameCode, streaming]);
 
     async function pollApiStatusOnce() {
         if (username === "") return;
         const status = await getApiStatusForPlayer();
-        setApiStatus(status.data);
+        setApiStatus(sawVersion(status).data);
     }
 
     async function pollApiSummaryOnce() {
@@ -36,30 +77,82 @@ function App() {
     }
 
     function getApiStatusForPlayer() {
-        return axios.get(getUrl() + `/game/${gameCode}/player/${username}`);
+        return axios.get(getUrl() + `/game/${gameCode}/player/${username}`, {params: seenVersionParams()});
     }
 
     function getApiSummaryForPlayer() {
-        return axios.get(getUrl() + `/game/${gameCode}`)
+        return axios.get(getUrl() + `/game/${gameCode}`, {params: seenVersionParams()})
+    }
+
+    function seenVersionParams() {
+        return seenVersion.current === undefined ? {} : {since: seenVersion.current};
     }
 
-    function usernameJoined(joinedUsername, joinedGame) {
-        axios.post(getUrl() + '/join', {username: joinedUsername, game: joinedGame});
+    function sawVersion(response) {
+        const version = Number(response.headers["x-game-version"]);
+        if (version && !(seenVersion.current >= version)) seenVersion.current = version;
+        return response;
+    }
+
+    async function usernameJoined(joinedUsername, joinedGame) {
+        const joined = await axios.post(getUrl() + '/join', {username: joinedUsername, game: joinedGame});
+        seenVersion.current = undefined;
+        sawVersion(joined);
         setUsername(joinedUsername);
         setGameCode(joinedGame);
         pollApiStatusOnce();
     }
 
-    function phraseSubmitted(phrase) {
-        axios.post(getUrl() + '/phrase', {username: username, phrase: phrase, game: gameCode});
+    async function phraseSubmitted(phrase) {
+        sawVersion(await submit('/phrase', {username: username, phrase: phrase, game: gameCode}));
         pollApiStatusOnce();
     }
 
-    function artSubmitted(art) {
-        axios.post(getUrl() + '/image', {username: username, image: art, game: gameCode});
+    async function artSubmitted(art) {
+        sawVersion(await uploadArt(art));
         pollApiStatusOnce();
     }
 
+    async function uploadArt(art) {
+        // sent in chunks, so a dropped connection picks up from the last chunk the API has instead of starting over
+        const image = dataUrlToBlob(art);
+        const start = await withRetries(() => axios.post(getUrl() + '/image/uploads',
+            {username: username, game: gameCode, contentType: image.type}));
+        const uploadUrl = getUrl() + '/image/uploads/' + start.data.upload;
+        let offset = 0;
+        while (offset < image.size) {
+            const chunk = image.slice(offset, offset + start.data.maxChunkBytes);
+            const sent = await withRetries(() => axios.put(uploadUrl + '?offset=' + offset, chunk,
+                {headers: {"Content-Type": "application/octet-stream"}}),
+                () => axios.get(uploadUrl).then((response) => { offset = response.data.offset; }));
+            offset = sent ? sent.data.offset : offset;
+        }
+        // the upload doubles as the idempotency key, so finalizing again after a failure saves the image once
+        return withRetries(() => axios.post(uploadUrl + '/finalize'));
+    }
+
+    function dataUrlToBlob(dataUrl) {
+        const [header, data] = dataUrl.split(",");
+        const bytes = Uint8Array.from(atob(data), (character) => character.charCodeAt(0));
+        return new Blob([bytes], {type: header.slice("data:".length).split(";")[0]});
+    }
+
+    function submit(path, body) {
+        // retries after network failures carry the same key, so the API saves a post that did arrive only once
+        const headers = {"Idempotency-Key": Date.now().toString(36) + Math.random().toString(36).slice(2)};
+        return withRetries(() => axios.post(getUrl() + path, body, {headers}));
+    }
+
+    function withRetries(request, resume) {
+        // after a network failure, resume (when given) finds out where to carry on from instead of retrying
+        const attempt = (number) => request().catch((error) => {
+            if (error.response || number >= SUBMIT_ATTEMPTS) throw error;
+            return new Promise((resolve) => setTimeout(resolve, 1000 * number))
+                .then(() => resume ? resume() : attempt(number + 1));
+        });
+        return attempt(1);
+    }
+
     function getStatusPanelByStatus(status) {
         if (status.description === "GAME_OVER" || apiSummary === undefined) {
             return <div></div>;
@@ -104,7 +197,7 @@ function App() {
                 );
             case "GAME_OVER":
                 return (
-                    <Results baseUrl={getUrl()} gameCode={gameCode}/>
+                    <Results baseUrl={getUrl()} gameCode={gameCode} since={seenVersion.current}/>
                 );
             case "WAIT":
                 return (
@@ -10,11 +10,14 @@ jest.mock("axios");
 describe('the example frontend', () => {
 
     function mockGets(statusData = {}, summaryPlayers = [], resultsData = [], summaryIsJoinable = false, summaryPhaseNumber = 1, summaryCanStart = true) {
-        axios.get = jest.fn((url) => {
+        axios.get = jest.fn((url, config) => {
             if (url.match("\/game\/.*\/player\/.*")) {
-                return {data: statusData};
+                // a long poll is held until the game changes, which it never does here
+                return config && config.params && config.params.wait
+                    ? new Promise(() => {})
+                    : {data: statusData, headers: {}};
             } else if (url.includes("results")) {
-                return Promise.resolve({data: resultsData});
+                return Promise.resolve({data: resultsData, headers: {}});
             } else if (url.match("\/game\/.*")) {
                 return {
                     data: {
@@ -22,7 +25,8 @@ describe('the example frontend', () => {
                         canJoin: summaryIsJoinable,
                         phaseNumber: summaryPhaseNumber,
                         canStart: summaryCanStart
-                    }
+                    },
+                    headers: {}
                 };
             }
         });
@@ -49,7 +53,16 @@ describe('the example frontend', () => {
             mockGets();
             render(<Results baseUrl={"xyz.abc.com"} gameCode={"TheClubhouse"}/>);
             await wait(() => {
-                expect(axios.get).toHaveBeenCalledWith("xyz.abc.com/game/TheClubhouse/results");
+                expect(axios.get).toHaveBeenCalledWith("xyz.abc.com/game/TheClubhouse/results", {params: {}});
+                done();
+            });
+        });
+
+        test('asks for results at least as new as the game version the player has seen', async (done) => {
+            mockGets();
+            render(<Results baseUrl={"xyz.abc.com"} gameCode={"TheClubhouse"} since={12}/>);
+            await wait(() => {
+                expect(axios.get).toHaveBeenCalledWith("xyz.abc.com/game/TheClubhouse/results", {params: {since: 12}});
                 done();
             });
         });
@@ -66,7 +79,7 @@ describe('the example frontend', () => {
                     status: {description: "SUBMIT_INITIAL_PHRASE"}
                 }
             ], [], true, 1);
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {queryByText, getByText} = joinGame();
             await wait(() => {
                 expect(getByText('Submit a Phrase'));
@@ -86,7 +99,7 @@ describe('the example frontend', () => {
                     status: {description: "WAIT"}
                 }
             ], [], false);
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {queryByText, getByText} = joinGame();
             await wait(() => {
                 expect(getByText('Submit a Phrase'));
@@ -105,7 +118,7 @@ describe('the example frontend', () => {
                     status: {description: "SUBMIT_PHRASE"}
                 }
             ]);
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {queryByText, getByText} = joinGame();
             await wait(() => {
                 expect(getByText('Submit a Phrase'));
@@ -129,7 +142,7 @@ describe('the example frontend', () => {
                     status: {description: "WAIT"}
                 }
             ]);
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {getByText} = joinGame();
             await wait(() => {
                 expect(getByText('Submit an Image'));
@@ -149,7 +162,7 @@ describe('the example frontend', () => {
                     status: {description: "SUBMIT_IMAGE"}
                 }
             ]);
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {getByText} = joinGame();
             await wait(() => {
                 expect(getByText('Waiting for other players...'));
@@ -168,7 +181,7 @@ describe('the example frontend', () => {
                     status: {description: "SUBMIT_IMAGE"}
                 }
             ], [], false, 1);
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {getByText} = joinGame();
             await wait(() => {
                 expect(getByText('Round: 1 of 2'));
@@ -187,7 +200,7 @@ describe('the example frontend', () => {
                     status: {description: "SUBMIT_IMAGE"}
                 }
             ], [], false, 5);
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {getByText} = joinGame();
             await wait(() => {
                 expect(getByText('Round: (Game Ending...)'));
@@ -206,7 +219,7 @@ describe('the example frontend', () => {
                     status: {description: "GAME_OVER"}
                 }
             ]);
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {queryByText, getByText} = joinGame();
             await wait(() => {
                 expect(getByText('Game Over!'));
@@ -221,7 +234,7 @@ describe('the example frontend', () => {
 
         test("shows the identity panel when the API is in SUBMIT_INITIAL_PHRASE state", async (done) => {
             mockGets({description: "SUBMIT_INITIAL_PHRASE"});
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {getByText} = joinGame();
             await wait(() => {
                 getByText('Your Name: Billy');
@@ -232,7 +245,7 @@ describe('the example frontend', () => {
 
         test("shows the identity panel when the API is in SUBMIT_PHRASE state", async (done) => {
             mockGets({description: "SUBMIT_PHRASE"});
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {getByText} = joinGame();
             await wait(() => {
                 getByText('Your Name: Billy');
@@ -243,7 +256,7 @@ describe('the example frontend', () => {
 
         test("shows the identity panel when the API is in SUBMIT_IMAGE state", async (done) => {
             mockGets({description: "SUBMIT_IMAGE"});
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {getByText} = joinGame();
             await wait(() => {
                 getByText('Your Name: Billy');
@@ -254,7 +267,7 @@ describe('the example frontend', () => {
 
         test("shows the identity panel when the API is in WAIT state", async (done) => {
             mockGets({description: "WAIT"});
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {getByText} = joinGame();
             await wait(() => {
                 getByText('Your Name: Billy');
@@ -274,7 +287,7 @@ describe('the example frontend', () => {
                     status: {description: "GAME_OVER"}
                 }
             ]);
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {queryByText} = joinGame();
             await wait(() => {
                 expect(queryByText(/Your Name:/)).not.toBeInTheDocument();
@@ -285,7 +298,7 @@ describe('the example frontend', () => {
 
         test("shows the identity panel when the API is in undefined state", async (done) => {
             mockGets({description: ""});
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {getByText} = joinGame();
             await wait(() => {
                 getByText('Your Name: Billy');
@@ -319,7 +332,7 @@ describe('the example frontend', () => {
         test("shows the submit phrase form and warning when the API is in SUBMIT_INITIAL_PHRASE state and no one has submitted", async (done) => {
             mockGets({description: "SUBMIT_INITIAL_PHRASE"}, [], [], true);
 
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {getByText} = joinGame();
             await wait(() => {
                 getByText('Submit a Phrase');
@@ -331,7 +344,7 @@ describe('the example frontend', () => {
         test("Game start warning disappears once someone has submitted", async (done) => {
             mockGets({description: "SUBMIT_INITIAL_PHRASE"});
 
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {getByText, queryByText} = joinGame();
             await wait(() => {
                 getByText('Submit a Phrase');
@@ -343,7 +356,7 @@ describe('the example frontend', () => {
         test("shows the submit phrase form when the API is in SUBMIT_PHRASE state", async (done) => {
             mockGets({description: "SUBMIT_PHRASE"});
 
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {getByText} = joinGame();
             await wait(() => {
                 getByText('Submit a Phrase');
@@ -357,7 +370,7 @@ describe('the example frontend', () => {
                 prompt: "Once upon a time",
                 previousPlayerUsername: "Tinkerbell"
             });
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {getByText} = joinGame();
             await wait(() => {
                 getByText('Draw this phrase (from Tinkerbell): "Once upon a time"');
@@ -371,7 +384,7 @@ describe('the example frontend', () => {
                 prompt: "Once upon a time",
                 previousPlayerUsername: "Tinkerbell"
             });
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {getByText} = joinGame();
             await wait(() => {
                 const suggestionInitiator = getByText('I need a drawing tool suggestion!');
@@ -387,7 +400,7 @@ describe('the example frontend', () => {
 
         test("shows the wait dialogue when the API is in WAIT state", async (done) => {
             mockGets({description: "WAIT"});
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             const {getByText} = joinGame();
             await wait(() => {
                 getByText(/Waiting for other players/);
@@ -397,7 +410,7 @@ describe('the example frontend', () => {
     });
     describe('sends the right stuff to the API', () => {
         test("hits the join API endpoint when you submit the join form", async (done) => {
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             mockGets({description: "WAIT"});
             joinGame();
             await wait(() => {
@@ -410,7 +423,7 @@ describe('the example frontend', () => {
         });
 
         test("hits the phrase API endpoint when you submit the phrase form and summary says can start", async (done) => {
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             mockGets({description: "SUBMIT_INITIAL_PHRASE"}, [], [], false, 1, true);
             let {getByLabelText, getByText} = joinGame();
             await wait(() => {
@@ -428,13 +441,13 @@ describe('the example frontend', () => {
                     username: "Billy",
                     game: "TheClubhouse",
                     phrase: "No ghouls allowed"
-                });
+                }, {headers: {"Idempotency-Key": expect.any(String)}});
                 done();
             });
         });
 
         test("doth not hit the phrase API endpoint when you submit the phrase form if summary says cannot start", async (done) => {
-            axios.post = jest.fn();
+            axios.post = jest.fn(() => Promise.resolve({headers: {}}));
             mockGets({description: "SUBMIT_INITIAL_PHRASE"}, [], [], false, 1, false);
             let {getByLabelText, getByText} = joinGame();
             await wait(() => {
@@ -451,8 +464,11 @@ describe('the example frontend', () => {
             done();
         });
 
-        test("hits the image API endpoint when you submit the image form", async (done) => {
-            axios.post = jest.fn();
+        test("uploads the image to the API when you submit the image form", async (done) => {
+            axios.post = jest.fn((url) => Promise.resolve(url.endsWith("/image/uploads")
+                ? {data: {upload: "u1", offset: 0, maxChunkBytes: 16}, headers: {}}
+                : {headers: {}}));
+            axios.put = jest.fn((url, chunk) => Promise.resolve({data: {offset: Number(url.split("=")[1]) + chunk.size}}));
             mockGets({description: "SUBMIT_IMAGE"});
 
             const imageFile = new File(['imageXXXimageYYYimageZZZ'], 'teledraw.png', {
@@ -475,12 +491,13 @@ describe('the example frontend', () => {
                 });
             });
             await wait(() => {
-                expect(axios.post).toHaveBeenCalledWith('http://localhost:5000/image',
-                    {
-                        username: 'Billy',
-                        image: 'data:image/png;base64,aW1hZ2VYWFhpbWFnZVlZWWltYWdlWlpa',
-                        game: 'TheClubhouse'
-                    });
+                expect(axios.post).toHaveBeenCalledWith('http://localhost:5000/image/uploads',
+                    {username: 'Billy', game: 'TheClubhouse', contentType: 'image/png'});
+                expect(axios.put).toHaveBeenCalledWith('http://localhost:5000/image/uploads/u1?offset=0',
+                    expect.any(Blob), {headers: {"Content-Type": "application/octet-stream"}});
+                expect(axios.put).toHaveBeenCalledWith('http://localhost:5000/image/uploads/u1?offset=16',
+                    expect.any(Blob), {headers: {"Content-Type": "application/octet-stream"}});
+                expect(axios.post).toHaveBeenCalledWith('http://localhost:5000/image/uploads/u1/finalize');
                 done();
             });
         });
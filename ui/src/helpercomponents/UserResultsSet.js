@@ -2,16 +2,22 @@ import React from "react";
 
 export default function UserResultsSet(props) {
 
+    function thumbnail(submission) {
+        return <a className="row-item" href={submission} target="_blank" rel="noopener noreferrer">
+            <img className="results-image" src={`${submission}?size=thumbnail`} alt=""/>
+        </a>;
+    }
+
     function imageOrPhrase(index, submission) {
         return index % 2 === 0 ? <div className="row-item">" {submission} "</div> :
-            <img className="row-item results-image" src={submission} alt=""/>;
+            thumbnail(submission);
     }
 
     function imageOrPhrasePlusLeaderText(index, submission) {
         return index % 2 === 0 ? <>
             <div className="row-item">" {submission} "</div>
             <div className="row-item">Leading to...</div>
-        </> : <><img className="row-item" src={submission} alt=""/>
+        </> : <>{thumbnail(submission)}
             <div className="row-item">Leading to...</div>
         </>;
     }
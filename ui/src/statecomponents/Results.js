@@ -3,12 +3,12 @@ import axios from "axios";
 import UserResultsSet from "../helpercomponents/UserResultsSet.js";
 import "../results.css";
 
-export default function Results({baseUrl, gameCode}) {
+export default function Results({baseUrl, gameCode, since}) {
 
     const [results, setResults] = useState([]);
 
     useEffect(() => {
-        axios.get(`${baseUrl}/game/${gameCode}/results`)
+        axios.get(`${baseUrl}/game/${gameCode}/results`, {params: since === undefined ? {} : {since}})
             .then((response) => {
                 setResults(response.data)
             })